@@ -12,6 +12,9 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 import os
+import tempfile
+
+import django
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -30,6 +33,7 @@ STATIC_URL = '/static/'
 # Application definition
 
 MIDDLEWARE = [
+    'notebook.instrumentation.StageTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -62,6 +66,22 @@ WSGI_APPLICATION = 'NotebookProject.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            'timeout': 20,  # seconds a write waits for another process' transaction before "database is locked"
+        },
+        # A file rather than shared-cache memory, so tests with concurrent requests lock like production
+        'TEST': {'NAME': os.path.join(tempfile.gettempdir(), 'notebook_test_db.sqlite3')},
+    }
+}
+# Take SQLite's write lock when a transaction starts (Django 5.1+), so concurrent saves queue up
+# instead of failing when a read lock can't be upgraded
+if django.VERSION >= (5, 1):
+    DATABASES['default']['OPTIONS']['transaction_mode'] = 'IMMEDIATE'
+
 # DATABASES = {
 #     'default': {
 #         'ENGINE': 'django.db.backends.postgresql',
@@ -164,4 +184,89 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 BOOK_STORAGE_DIR = os.path.join(MEDIA_ROOT, 'book_storage')
 DATA_UPLOAD_MAX_MEMORY_SIZE = 100 * 1024 * 1024  # 100MB
-ALLOWED_HOSTS = ['*']
\ No newline at end of file
+ALLOWED_HOSTS = ['*']
+
+# OCR model registry
+OCR_WEIGHTS_PATH = os.path.join(BASE_DIR, 'model_checkpoint_weights.hdf5')
+OCR_WARMUP = True  # run a dummy batch through the CRNN right after loading
+OCR_HOT_RELOAD = True  # reload the CRNN when the weights file's mtime changes
+OCR_BATCH_SIZE = 16  # line images per CRNN forward pass
+
+# Cross-request dynamic batching of CRNN inference (see notebook/inference_queue.py)
+OCR_DYNAMIC_BATCHING = False
+OCR_BATCH_MAX_SIZE = 32  # most lines run in one forward pass
+OCR_BATCH_MAX_WAIT_MS = 5  # how long a line waits for others to join its batch
+
+# Run the CRNN with a dynamic input width and trim trailing blank columns,
+# so compute scales with the written length of each line
+OCR_VARIABLE_WIDTH = False
+
+# Runtime the CRNN is served from: 'keras' or 'tflite' (built by manage.py export_crnn)
+OCR_BACKEND = 'keras'
+OCR_TFLITE_PATH = os.path.join(BASE_DIR, 'model_crnn.tflite')
+OCR_TFLITE_THREADS = None  # None lets TFLite pick
+
+# CTC decoding: 'greedy' (NumPy), 'beam' (prefix beam search) or 'tf' (K.ctc_decode).
+# Requests to /extract-text/ can override with "decoder" and "beam_width".
+OCR_CTC_DECODER = 'greedy'
+OCR_BEAM_WIDTH = 10
+OCR_MAX_BEAM_WIDTH = 50  # larger requested widths are rejected; decoding cost grows with the width
+OCR_LM_CORPUS_PATH = None  # UTF-8 Vietnamese text / word list biasing the beam search
+OCR_LM_ORDER = 3
+OCR_LM_WEIGHT = 0.5
+
+# ViT5 OCR post-correction (loaded lazily, once per process)
+VIT5_MODEL_PATH = os.path.join(BASE_DIR, 'models', 'vit5-finetuned')
+VIT5_NUM_THREADS = None  # torch intra-op threads; None keeps torch's default
+VIT5_MAX_LENGTH = 64  # token limit of each corrected chunk
+VIT5_BATCH_SIZE = 8  # chunks per generate() call
+
+# Result caches for CRNN lines and ViT5 corrections (see notebook/result_cache.py)
+OCR_CACHE_ENABLED = True
+OCR_CACHE_MEMORY_ENTRIES = 10000  # per cache, per process
+OCR_CACHE_PATH = os.path.join(BASE_DIR, 'ocr_cache.sqlite3')  # None keeps caches in memory only
+OCR_CACHE_DISK_ENTRIES = 100000
+OCR_CACHE_DISK_MAX_MB = 256  # per cache; least recently used rows are evicted beyond it
+
+# Asynchronous OCR jobs ("async": true on /extract-text/), run by manage.py ocr_worker
+OCR_JOBS_DIR = os.path.join(BASE_DIR, 'ocr_jobs')
+OCR_JOB_TIMEOUT = 600  # seconds before a running job of a dead worker is requeued
+
+# /api/books/ pagination
+BOOK_LIST_PAGE_SIZE = 50
+BOOK_LIST_MAX_PAGE_SIZE = 500
+
+# Writes of book_storage/<book>/data.json made within this many ms are merged into one
+METADATA_COALESCE_MS = 200
+
+# Page images are stored once per distinct content in book_storage/_blobs (see notebook/page_blobs.py),
+# as uploaded ('png') or re-encoded as 'optimized-png' or lossless 'webp'
+PAGE_IMAGE_FORMAT = 'png'
+
+# Pen strokes saved incrementally are drawn into the page image once this many are logged
+PAGE_STROKE_COMPACT_EVERY = 50
+
+# SQLite FTS5 index of page OCR text for /api/search/ (see notebook/search_index.py)
+SEARCH_INDEX_PATH = os.path.join(BASE_DIR, 'search_index.sqlite3')
+
+# Per-stage timing (see notebook/instrumentation.py): Server-Timing headers, a JSON log line per
+# request on the notebook.timing logger and Prometheus histograms at /metrics
+STAGE_TIMING_ENABLED = True
+STAGE_TIMING_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)  # seconds
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'notebook.timing': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
+
+# Which endpoints this process serves: 'all', 'web' (books, pages, search; TensorFlow and torch are
+# never imported) or 'ocr' (extract-text/, ocr-lines/, api/ocr/ and api/book/<id>/page/<id>/ocr/).
+# Run CRUD and OCR as separate worker pools by starting them with NOTEBOOK_ROLE=web / NOTEBOOK_ROLE=ocr
+# and routing the OCR paths to the latter; manage.py measure_startup compares the two.
+NOTEBOOK_ROLE = os.environ.get('NOTEBOOK_ROLE', 'all')
@@ -1,14 +1,153 @@
-import torch
-from transformers import T5Tokenizer, T5ForConditionalGeneration
-model_name = "VietAI/vit5-base"
-tokenizer = T5Tokenizer.from_pretrained(model_name)
-model = T5ForConditionalGeneration.from_pretrained(model_name)
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-model = model.to(device)
-model = T5ForConditionalGeneration.from_pretrained("models/vit5-finetuned")
-tokenizer = T5Tokenizer.from_pretrained("models/vit5-finetuned")
+"""ViT5 post-correction of OCR text.
+
+Only the configured model (``VIT5_MODEL_PATH``) is loaded, lazily on the
+first correction or eagerly with ``manage.py warmup_models``, and one copy
+is kept per process. torch and transformers are imported at that point too,
+so importing this module (and the views) stays cheap.
+
+Text is corrected in line- or sentence-sized chunks that fit the model's
+input length, batched through ``generate`` with padding and stitched back
+in order, so long pages are neither truncated nor generated as one sequence.
+Corrected chunks are cached by normalized text and model version (see
+``result_cache``), so resubmitted pages only generate for new chunks.
+"""
+import os
+import re
+import threading
+
+from django.conf import settings
+
+from notebook.instrumentation import stage, timed
+from notebook.result_cache import get_cache, make_key, normalize_text
+
+PREFIX = "sửa: "
+
+
+class CorrectionService:
+    """Loads a T5 correction model once and runs it under inference mode.
+
+    Args:
+        model_path (str): Local folder or hub name of the finetuned model.
+        num_threads (int): torch intra-op threads; None keeps torch's default.
+        max_length (int): Token limit of each input chunk and its correction.
+        batch_size (int): Chunks per generate() call.
+    """
+
+    def __init__(self, model_path, num_threads=None, max_length=64, batch_size=8):
+        self.model_path = model_path
+        self.num_threads = num_threads
+        self.max_length = max_length
+        self.batch_size = batch_size
+        self.tokenizer = None
+        self.model = None
+        self.device = None
+        self.model_version = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Load tokenizer and model onto the device (no-op when already loaded)."""
+        if self.model is not None:
+            return self
+        with self._lock, stage('correction_load'):
+            if self.model is None:
+                import torch
+                from transformers import T5Tokenizer, T5ForConditionalGeneration
+
+                if self.num_threads:
+                    torch.set_num_threads(self.num_threads)
+                self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+                self.tokenizer = T5Tokenizer.from_pretrained(self.model_path)
+                model = T5ForConditionalGeneration.from_pretrained(self.model_path)
+                self.model = model.to(self.device).eval()
+                mtime = os.path.getmtime(self.model_path) if os.path.exists(self.model_path) else None
+                self.model_version = f"{self.model_path}@{mtime}"
+        return self
+
+    def split_chunks(self, text):
+        """Split text into sentences, breaking any sentence that doesn't fit
+        the model's input length at word boundaries."""
+        self.load()
+        # Room left after the prefix and the end-of-sequence token
+        limit = self.max_length - len(self.tokenizer.tokenize(PREFIX)) - 1
+
+        chunks = []
+        for sentence in re.split(r'(?<=[.!?;])\s+', text.strip()):
+            words, tokens = [], 0
+            for word in sentence.split():
+                word_tokens = len(self.tokenizer.tokenize(word))
+                if words and tokens + word_tokens > limit:
+                    chunks.append(' '.join(words))
+                    words, tokens = [], 0
+                words.append(word)
+                tokens += word_tokens
+            if words:
+                chunks.append(' '.join(words))
+        return chunks
+
+    def correct_batch(self, chunks):
+        """Correct short chunks, batch_size at a time, returning them in order."""
+        import torch
+
+        self.load()
+        corrected = [""] * len(chunks)
+
+        # Only chunks that aren't cached go through the model
+        cache = get_cache('correction')
+        keys = [make_key(self.model_version, normalize_text(chunk)) for chunk in chunks]
+        pending = []
+        for i, key in enumerate(keys):
+            cached = cache.get(key) if cache is not None else None
+            if cached is None:
+                pending.append(i)
+            else:
+                corrected[i] = cached
+
+        # Batch chunks of similar length together to keep padding small
+        order = sorted(pending, key=lambda i: len(chunks[i]))
+        for start in range(0, len(order), self.batch_size):
+            indices = order[start:start + self.batch_size]
+            inputs = self.tokenizer([PREFIX + chunks[i] for i in indices], return_tensors="pt",
+                                    padding=True, max_length=self.max_length, truncation=True).to(self.device)
+            with torch.inference_mode():
+                output = self.model.generate(**inputs, max_length=self.max_length)
+            for i, text in zip(indices, self.tokenizer.batch_decode(output, skip_special_tokens=True)):
+                corrected[i] = text
+                if cache is not None:
+                    cache.set(keys[i], text)
+        return corrected
+
+    @timed('correction')
+    def correct_lines(self, lines):
+        """Correct OCR lines and join the result into one text."""
+        chunks = [chunk for line in lines for chunk in self.split_chunks(line)]
+        return ' '.join(self.correct_batch(chunks)) if chunks else ""
+
+    def correct(self, text):
+        return self.correct_lines([text])
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_correction_service():
+    """Return the process-wide CorrectionService (the model loads on first use)."""
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = CorrectionService(
+                    getattr(settings, 'VIT5_MODEL_PATH', os.path.join(settings.BASE_DIR, 'models', 'vit5-finetuned')),
+                    num_threads=getattr(settings, 'VIT5_NUM_THREADS', None),
+                    max_length=getattr(settings, 'VIT5_MAX_LENGTH', 64),
+                    batch_size=getattr(settings, 'VIT5_BATCH_SIZE', 8),
+                )
+    return _service
+
 
 def correct_ocr(text):
-    inputs = tokenizer("sửa: " + text, return_tensors="pt", max_length=64, truncation=True)
-    output = model.generate(inputs.input_ids, max_length=64)
-    return tokenizer.decode(output[0], skip_special_tokens=True)
+    return get_correction_service().correct(text)
+
+
+def correct_ocr_lines(lines):
+    return get_correction_service().correct_lines(lines)
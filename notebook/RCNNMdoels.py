@@ -1,114 +1,211 @@
+import threading
+
 import cv2
 import numpy as np
-import tensorflow as tf
-from tensorflow.keras.layers import Dense, LSTM, Reshape, BatchNormalization, Input, Conv2D, MaxPool2D, Lambda, Bidirectional, Add, Activation
-from tensorflow.keras.models import Model
-import tensorflow.keras.backend as K
 
-def PreprocessData(img, resize_max_width=2167):
+from notebook.alphabet import char_list
+from notebook.ctc_decoder import clean_text, greedy_decode
+from notebook.instrumentation import stage
+from notebook.result_cache import make_key
+
+
+# Every line is scaled to this height; the fixed-width model expects this width
+MODEL_HEIGHT = 118
+MODEL_WIDTH = 2167
+
+# Widths short lines are padded to instead of the full MODEL_WIDTH
+# (only usable with a model that accepts variable-width input)
+WIDTH_BUCKETS = (512, 1024, MODEL_WIDTH)
+
+# Blank columns kept after the last ink column when trimming a line
+TRIM_MARGIN = 27
+
+_buffers = threading.local()
+
+
+def PreprocessData(img, resize_max_width=2167, out=None):
     """Preprocess Image
     Args:
         img (numpy.array): Image read by opencv
+        resize_max_width (int): Lines wider than this are squeezed to fit
+        out (numpy.array): Optional float32 buffer of shape (118, 2167, 1) to write into
     Return:
-        PreprocessedImage
+        PreprocessedImage as float32 in [0, 1]
     """
-    # Convert to grayscale
-    img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    line = resize_line(img, resize_max_width)
+    if out is None:
+        out = np.empty((MODEL_HEIGHT, MODEL_WIDTH, 1), dtype=np.float32)
+    return binarize_line(line, out)
+
+
+def resize_line(img, resize_max_width=MODEL_WIDTH):
+    """Convert a line image to grayscale with a height of 118, keeping its aspect ratio
+    Args:
+        img (numpy.array): Image read by opencv (BGR or already grayscale)
+        resize_max_width (int): Lines wider than this are squeezed to fit
+    Return:
+        uint8 array of shape (118, width)
+    """
+    if img.ndim == 3:
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
     height, width = img.shape
-    
-    # Resize to fixed height of 118, maintaining aspect ratio
-    new_width = int(118 / height * width)
-    img = cv2.resize(img, (new_width, 118))
-    
-    # Handle width constraint
-    current_width = img.shape[1]
-    if current_width > resize_max_width:
-        # If image is too wide, resize it to fit max width
-        img = cv2.resize(img, (resize_max_width, 118))
-        current_width = resize_max_width
-    
-    # Pad to exact width of 2167 (this ensures consistent input size)
-    if current_width < 2167:
-        pad_width = 2167 - current_width
-        img = np.pad(img, ((0, 0), (0, pad_width)), 'constant', constant_values=0)
-    
-    # Apply Gaussian blur
-    img = cv2.GaussianBlur(img, (5, 5), 0)
-    
-    # Apply adaptive threshold
-    img = cv2.adaptiveThreshold(img, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
-                               cv2.THRESH_BINARY_INV, 11, 4)
-    
-    # Add channel dimension
-    img = np.expand_dims(img, axis=2)
-    
-    # Normalize to [0, 1]
-    img = img / 255.0
-    
-    return img
-
-
-
-char_list = r" #'()+,-./0123456789:ABCDEFGHIJKLMNOPQRSTUVWXYabcdeghiklmnopqrstuvwxyzÂÊÔàáâãèéêìíòóôõùúýăĐđĩũƠơưạảấầẩậắằẵặẻẽếềểễệỉịọỏốồổỗộớờởỡợụủỨứừửữựỳỵỷỹ"
-
-# input with shape of height=118 and width=2167
-inputs = Input(shape=(118,2167,1))
-
-# Block 1
-x = Conv2D(64, (3,3), padding='same')(inputs)
-x = MaxPool2D(pool_size=3, strides=3)(x)
-x = Activation('relu')(x)
-x_1 = x 
-
-# Block 2
-x = Conv2D(128, (3,3), padding='same')(x)
-x = MaxPool2D(pool_size=3, strides=3)(x)
-x = Activation('relu')(x)
-x_2 = x
-
-# Block 3
-x = Conv2D(256, (3,3), padding='same')(x)
-x = BatchNormalization()(x)
-x = Activation('relu')(x)
-x_3 = x
-
-# Block4
-x = Conv2D(256, (3,3), padding='same')(x)
-x = BatchNormalization()(x)
-x = Add()([x,x_3])
-x = Activation('relu')(x)
-x_4 = x
-
-# Block5
-x = Conv2D(512, (3,3), padding='same')(x)
-x = BatchNormalization()(x)
-x = Activation('relu')(x)
-x_5 = x
-
-# Block6
-x = Conv2D(512, (3,3), padding='same')(x)
-x = BatchNormalization()(x)
-x = Add()([x,x_5])
-x = Activation('relu')(x)
-
-# Block7
-x = Conv2D(1024, (3,3), padding='same')(x)
-x = BatchNormalization()(x)
-x = MaxPool2D(pool_size=(3, 1))(x)
-x = Activation('relu')(x)
-
-# pooling layer with kernel size (2,2) to make the height/2 #(1,9,512)
-x = MaxPool2D(pool_size=(3, 1))(x)
-
-# # to remove the first dimension of one: (1, 31, 512) to (31, 512) 
-squeezed = Lambda(lambda x: K.squeeze(x, 1))(x)
-
-# # # bidirectional LSTM layers with units=128
-blstm_1 = Bidirectional(LSTM(512, return_sequences=True, dropout = 0.2))(squeezed)
-blstm_2 = Bidirectional(LSTM(512, return_sequences=True, dropout = 0.2))(blstm_1)
-
-# # this is our softmax character proprobility with timesteps 
-outputs = Dense(len(char_list)+1, activation = 'softmax')(blstm_2)
+
+    # A single resize straight to the final width
+    new_width = min(max(int(MODEL_HEIGHT / height * width), 1), resize_max_width)
+    return cv2.resize(img, (new_width, MODEL_HEIGHT))
+
+
+def binarize_line(line, out, target_width=MODEL_WIDTH):
+    """Pad, blur and threshold a resized line straight into a float32 buffer
+    Args:
+        line (numpy.array): uint8 line returned by resize_line
+        out (numpy.array): float32 buffer of shape (118, target_width, 1)
+        target_width (int): Width the line is zero-padded to
+    Return:
+        out
+    """
+    return normalize_into(threshold_line(line, target_width), out)
+
+
+def threshold_line(line, target_width=MODEL_WIDTH):
+    """Zero-pad a resized line to target_width, then blur and threshold it
+    Args:
+        line (numpy.array): uint8 line returned by resize_line
+        target_width (int): Width the line is zero-padded to
+    Return:
+        uint8 array of shape (118, target_width) with ink at 255
+    """
+    padded = np.zeros((MODEL_HEIGHT, target_width), dtype=np.uint8)
+    width = min(line.shape[1], target_width)
+    padded[:, :width] = line[:, :width]
+
+    # Blur and threshold in place on the uint8 image
+    cv2.GaussianBlur(padded, (5, 5), 0, dst=padded)
+    cv2.adaptiveThreshold(padded, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                          cv2.THRESH_BINARY_INV, 11, 4, dst=padded)
+    return padded
+
+
+def normalize_into(binary, out):
+    """Scale a thresholded line to [0, 1] directly into a float32 buffer
+    Columns of out beyond the line's width are zeroed.
+    """
+    width = min(binary.shape[1], out.shape[1])
+    np.multiply(binary[:, :width], np.float32(1 / 255.0), out=out[:, :width, 0], casting='unsafe')
+    out[:, width:, 0] = 0
+    return out
+
+
+def ink_width(binary):
+    """Return the number of columns up to and including the last one with ink"""
+    columns = np.flatnonzero(binary.reshape(MODEL_HEIGHT, -1).any(axis=0))
+    return int(columns[-1]) + 1 if len(columns) else 0
+
+
+def trimmed_width(binary, buckets=WIDTH_BUCKETS):
+    """Width a thresholded line can be cut to without losing ink
+    Trailing blank columns are dropped, keeping TRIM_MARGIN of them so CTC
+    still sees blank timesteps after the last character, and the result is
+    rounded up to a bucket so lines of similar length can share a batch.
+    """
+    return bucket_width(min(ink_width(binary) + TRIM_MARGIN, MODEL_WIDTH), buckets)
+
+
+def bucket_width(width, buckets=WIDTH_BUCKETS):
+    """Return the smallest bucket a line of this width fits in"""
+    for bucket in sorted(buckets):
+        if width <= bucket:
+            return bucket
+    return max(buckets)
+
+
+def batch_buffer(batch_size, width=MODEL_WIDTH):
+    """Return a float32 batch buffer reused across calls on the current thread"""
+    cache = getattr(_buffers, 'cache', None)
+    if cache is None:
+        cache = _buffers.cache = {}
+    key = (batch_size, width)
+    if key not in cache:
+        cache[key] = np.empty((batch_size, MODEL_HEIGHT, width, 1), dtype=np.float32)
+    return cache[key]
+
+
+def build_crnn(input_width=MODEL_WIDTH):
+    """Build the CRNN graph
+    Args:
+        input_width (int): Width of the input lines, or None to accept any width.
+            No layer's weights depend on the width, so both variants load the
+            same checkpoint.
+    Return:
+        Keras Model
+    """
+    # TensorFlow is only imported once a model is built, so importing this
+    # module (e.g. from the views) doesn't load it
+    from tensorflow.keras.layers import Dense, LSTM, BatchNormalization, Input, Conv2D, MaxPool2D, Lambda, Bidirectional, Add, Activation
+    from tensorflow.keras.models import Model
+    import tensorflow.keras.backend as K
+
+    # input with shape of height=118 and width=2167 (or None)
+    inputs = Input(shape=(118,input_width,1))
+
+    # Block 1
+    x = Conv2D(64, (3,3), padding='same')(inputs)
+    x = MaxPool2D(pool_size=3, strides=3)(x)
+    x = Activation('relu')(x)
+    x_1 = x 
+
+    # Block 2
+    x = Conv2D(128, (3,3), padding='same')(x)
+    x = MaxPool2D(pool_size=3, strides=3)(x)
+    x = Activation('relu')(x)
+    x_2 = x
+
+    # Block 3
+    x = Conv2D(256, (3,3), padding='same')(x)
+    x = BatchNormalization()(x)
+    x = Activation('relu')(x)
+    x_3 = x
+
+    # Block4
+    x = Conv2D(256, (3,3), padding='same')(x)
+    x = BatchNormalization()(x)
+    x = Add()([x,x_3])
+    x = Activation('relu')(x)
+    x_4 = x
+
+    # Block5
+    x = Conv2D(512, (3,3), padding='same')(x)
+    x = BatchNormalization()(x)
+    x = Activation('relu')(x)
+    x_5 = x
+
+    # Block6
+    x = Conv2D(512, (3,3), padding='same')(x)
+    x = BatchNormalization()(x)
+    x = Add()([x,x_5])
+    x = Activation('relu')(x)
+
+    # Block7
+    x = Conv2D(1024, (3,3), padding='same')(x)
+    x = BatchNormalization()(x)
+    x = MaxPool2D(pool_size=(3, 1))(x)
+    x = Activation('relu')(x)
+
+    # pooling layer with kernel size (2,2) to make the height/2 #(1,9,512)
+    x = MaxPool2D(pool_size=(3, 1))(x)
+
+    # # to remove the first dimension of one: (1, 31, 512) to (31, 512) 
+    squeezed = Lambda(lambda x: K.squeeze(x, 1))(x)
+
+    # # # bidirectional LSTM layers with units=128
+    blstm_1 = Bidirectional(LSTM(512, return_sequences=True, dropout = 0.2))(squeezed)
+    blstm_2 = Bidirectional(LSTM(512, return_sequences=True, dropout = 0.2))(blstm_1)
+
+    # # this is our softmax character proprobility with timesteps 
+    outputs = Dense(len(char_list)+1, activation = 'softmax')(blstm_2)
+
+    return Model(inputs, outputs)
+
 
 def extract_text_from_image(image_path, model, char_list):
     """Extract text from a single image using the OCR model"""
@@ -123,20 +220,122 @@ def extract_text_from_image(image_path, model, char_list):
         processed_img = np.expand_dims(processed_img, axis=0)
         prediction = model.predict(processed_img, verbose=0)
         
-        # Use CTC decoder
-        out = K.get_value(K.ctc_decode(prediction, input_length=np.ones(prediction.shape[0])*prediction.shape[1],
-                                greedy=True)[0][0])
-        
-        # Convert prediction to text
-        pred_text = ""
-        for p in out[0]:  # Take first (and only) prediction
-            if int(p) != -1:
-                pred_text += char_list[int(p)]
-        
-        if pred_text.strip() == "n":
-            pred_text=""
-        # print(pred_text)
-        return pred_text.strip()
+        # Use CTC decoder, take first (and only) prediction
+        return ctc_decode_tf(prediction, char_list)[0]
     except Exception as e:
         print(f"Error extracting text from {image_path}: {str(e)}")
         return ""
+
+
+def labels_to_text(labels, char_list):
+    """Convert one row of CTC-decoded labels to text (-1 is padding)"""
+    return clean_text("".join(char_list[int(p)] for p in labels if int(p) != -1))
+
+
+def extract_text_from_arrays(images, model, char_list, batch_size=16, buckets=None, decoder=None,
+                             cache=None, cache_context=""):
+    """Extract text from many line images with batched inference
+    Args:
+        images (iterable): Line images decoded by opencv, in line order (None for unreadable ones)
+        model: Loaded OCR model
+        char_list (str): Characters the model was trained on
+        batch_size (int): Number of lines per forward pass
+        buckets (tuple): Widths to trim lines to (see trimmed_width). Only
+            valid for a model built with build_crnn(None); by default every
+            line keeps the full MODEL_WIDTH.
+        decoder (callable): CTC decoder from ctc_decoder.get_decoder
+            (default: greedy_decode)
+        cache: Optional result cache (result_cache.get_cache('crnn')); lines
+            are keyed by their preprocessed image plus cache_context, which
+            should identify the model version and decoder
+    Return:
+        List of texts, one per image ("" for unreadable images)
+    """
+    texts = dict(iter_text_from_arrays(images, model, char_list, batch_size=batch_size, buckets=buckets,
+                                       decoder=decoder, cache=cache, cache_context=cache_context))
+    return [texts[index] for index in range(len(texts))]
+
+
+def iter_text_from_arrays(images, model, char_list, batch_size=16, buckets=None, decoder=None,
+                          cache=None, cache_context=""):
+    """Yield (line index, text) for every image as soon as its text is known
+    Cached lines come out immediately and a batch is run as soon as
+    batch_size lines of the same width are waiting, so the first lines are
+    recognized while later ones are still being read. Takes the same
+    arguments as extract_text_from_arrays.
+    """
+    groups = {}
+
+    def run_batch(width):
+        lines = groups.pop(width)
+        buffer = batch_buffer(batch_size, width)
+        for slot, (_, binary, _) in enumerate(lines):
+            normalize_into(binary, buffer[slot])
+
+        try:
+            batch_texts = predict_texts(buffer[:len(lines)], model, char_list, decoder=decoder)
+        except Exception as e:
+            print(f"Error extracting text from batch starting at line {lines[0][0]}: {str(e)}")
+            for index, _, _ in lines:
+                yield index, ""
+            return
+
+        for (index, _, key), text in zip(lines, batch_texts):
+            if key is not None:
+                cache.set(key, text)
+            yield index, text
+
+    # Threshold every line, grouping them by the width they run at
+    for index, img in enumerate(images):
+        if img is None:
+            yield index, ""
+            continue
+        try:
+            with stage('preprocess'):
+                binary = threshold_line(resize_line(img))
+        except Exception as e:
+            print(f"Error preprocessing line {index}: {str(e)}")
+            yield index, ""
+            continue
+        width = trimmed_width(binary, buckets) if buckets else MODEL_WIDTH
+
+        key = None
+        if cache is not None:
+            key = make_key(cache_context, width, binary.tobytes())
+            cached = cache.get(key)
+            if cached is not None:
+                yield index, cached
+                continue
+
+        groups.setdefault(width, []).append((index, binary, key))
+        if len(groups[width]) == batch_size:
+            yield from run_batch(width)
+
+    for width in list(groups):
+        yield from run_batch(width)
+
+
+def predict_texts(batch, model, char_list, decoder=None):
+    """Run one forward pass and one CTC decode over a stacked batch
+    Args:
+        batch (numpy.array): Preprocessed lines of shape (N, 118, width, 1)
+        model: Loaded OCR model
+        char_list (str): Characters the model was trained on
+        decoder (callable): CTC decoder from ctc_decoder.get_decoder
+            (default: greedy_decode)
+    Return:
+        List of N texts
+    """
+    with stage('inference'):
+        prediction = model.predict(batch, batch_size=len(batch), verbose=0)
+    with stage('ctc_decode'):
+        return (decoder or greedy_decode)(prediction, char_list)
+
+
+def ctc_decode_tf(prediction, char_list):
+    """Greedy CTC decode with Keras' K.ctc_decode (builds TF ops on every call)"""
+    import tensorflow.keras.backend as K
+
+    out = K.get_value(K.ctc_decode(prediction, input_length=np.ones(prediction.shape[0])*prediction.shape[1],
+                            greedy=True)[0][0])
+    return [labels_to_text(row, char_list) for row in out]
@@ -0,0 +1,120 @@
+"""Micro-benchmarks of the OCR hot path.
+
+Everything runs on synthetic inputs: line images with random pen strokes
+shaped like the canvas' 595x90 lines, CRNN-like softmax outputs with a known
+text, and a randomly initialized CRNN unless real weights are asked for, so
+the suite runs on any machine. Each benchmark reports p50/p95 latency per
+call, throughput in items/s and the process' peak RSS after it ran.
+
+``manage.py benchmark_ocr`` runs the suite, saves results as JSON and can
+compare them with an earlier run (``compare``), failing on slowdowns.
+"""
+import resource
+import sys
+import time
+
+import numpy as np
+
+LINE_WIDTH = 595
+LINE_HEIGHT = 90
+
+
+def synthetic_line(rng, width=LINE_WIDTH, height=LINE_HEIGHT):
+    """White line image with a few words of random cursive-like strokes"""
+    import cv2
+
+    image = np.full((height, width, 3), 255, dtype=np.uint8)
+    x = int(rng.integers(5, 40))
+    end = int(rng.integers(width // 3, width - 10))
+    while x < end:
+        # One "word": a wobbly polyline around the line's middle
+        length = int(rng.integers(30, 120))
+        xs = np.linspace(x, min(x + length, width - 1), num=max(length // 4, 2))
+        ys = height / 2 + 14 * np.sin(xs / rng.uniform(3, 8)) + rng.normal(0, 3, size=xs.shape)
+        points = np.stack([xs, np.clip(ys, 5, height - 5)], axis=1).astype(np.int32)
+        cv2.polylines(image, [points.reshape(-1, 1, 2)], False, (0, 0, 0), thickness=int(rng.integers(2, 4)),
+                      lineType=cv2.LINE_AA)
+        x += length + int(rng.integers(10, 30))
+    return image
+
+
+def synthetic_lines(count, seed=0):
+    rng = np.random.default_rng(seed)
+    return [synthetic_line(rng) for _ in range(count)]
+
+
+def synthetic_outputs(char_list, lines, timesteps=240, noise=1.5, seed=0):
+    """Random texts and CRNN-like softmax outputs that encode them
+    Each character is held for a few timesteps with blanks in between, then
+    Gaussian noise is added to the logits so decoding isn't trivial.
+    """
+    rng = np.random.default_rng(seed)
+    classes = len(char_list) + 1
+    blank = classes - 1
+    texts, logits = [], np.zeros((lines, timesteps, classes), dtype=np.float32)
+
+    for i in range(lines):
+        length = int(rng.integers(5, timesteps // 6))
+        labels = rng.integers(0, len(char_list), size=length)
+        texts.append("".join(char_list[label] for label in labels).strip())
+
+        path = np.full(timesteps, blank)
+        positions = np.sort(rng.choice(np.arange(0, timesteps - 3, 4), size=length, replace=False))
+        for label, position in zip(labels, positions):
+            path[position:position + int(rng.integers(1, 3))] = label
+        logits[i, np.arange(timesteps), path] = 8.0
+
+    logits += rng.normal(scale=noise, size=logits.shape).astype(np.float32)
+    probs = np.exp(logits - logits.max(axis=-1, keepdims=True))
+    return texts, probs / probs.sum(axis=-1, keepdims=True)
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def measure(run, items=1, repeat=10, warmup=1):
+    """Time run() repeat times after warmup calls
+    Args:
+        run (callable): One benchmark iteration
+        items (int): Items (lines, pages...) processed per call, for throughput
+    Return:
+        {"p50_ms", "p95_ms", "mean_ms", "items_per_s", "peak_rss_mb"}
+    """
+    for _ in range(warmup):
+        run()
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - started)
+    timings = np.array(timings)
+    return {
+        'p50_ms': round(float(np.percentile(timings, 50)) * 1000, 3),
+        'p95_ms': round(float(np.percentile(timings, 95)) * 1000, 3),
+        'mean_ms': round(float(timings.mean()) * 1000, 3),
+        'items_per_s': round(items / float(np.median(timings)), 2),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+    }
+
+
+def compare(baseline, current, max_slowdown=0.1, metric='p50_ms'):
+    """Benchmarks of current slower than in baseline by more than max_slowdown
+    Args:
+        baseline, current (dict): "results" of two runs
+        max_slowdown (float): Allowed relative increase of metric (0.1 = 10%)
+    Return:
+        List of (name, baseline value, current value, relative change), worst first
+    """
+    regressions = []
+    for name, result in current.items():
+        before = baseline.get(name, {}).get(metric)
+        if not before or metric not in result:
+            continue
+        change = result[metric] / before - 1
+        if change > max_slowdown:
+            regressions.append((name, before, result[metric], change))
+    return sorted(regressions, key=lambda regression: regression[3], reverse=True)
@@ -0,0 +1,211 @@
+"""NumPy CTC decoders for the CRNN's softmax output.
+
+``greedy_decode`` does argmax, collapses repeats and drops blanks for the
+whole batch at once; it gives the same text as ``K.ctc_decode(greedy=True)``
+without building TensorFlow ops on every call. ``beam_search_decode`` is a
+CTC prefix beam search that can be biased by a character-level language
+model (``CharLanguageModel``) trained on Vietnamese text or a word list.
+
+The blank label is the last class, as in Keras' CTC implementation.
+"""
+import math
+import os
+import threading
+from collections import Counter, defaultdict
+
+import numpy as np
+
+NEG_INF = -float('inf')
+
+
+def clean_text(text):
+    """Final clean-up applied to every decoded line"""
+    # A lone "n" is what the model reads from an empty line
+    if text.strip() == "n":
+        return ""
+    return text.strip()
+
+
+def greedy_decode(probs, char_list):
+    """Best-path decode a batch of CRNN outputs
+    Args:
+        probs (numpy.array): Softmax output of shape (N, timesteps, len(char_list) + 1)
+        char_list (str): Characters the model was trained on
+    Return:
+        List of N texts
+    """
+    blank = probs.shape[-1] - 1
+    best = np.argmax(probs, axis=-1)
+
+    # Keep a label where it differs from the previous timestep and isn't blank
+    keep = np.ones_like(best, dtype=bool)
+    keep[:, 1:] = best[:, 1:] != best[:, :-1]
+    keep &= best != blank
+
+    chars = np.array(list(char_list))
+    return [clean_text("".join(chars[row[mask]])) for row, mask in zip(best, keep)]
+
+
+def beam_search_decode(probs, char_list, beam_width=10, lm=None, lm_weight=0.5, prune=1e-3):
+    """CTC prefix beam search over a batch of CRNN outputs
+    Args:
+        probs (numpy.array): Softmax output of shape (N, timesteps, len(char_list) + 1)
+        char_list (str): Characters the model was trained on
+        beam_width (int): Prefixes kept after each timestep
+        lm (CharLanguageModel): Optional character language model
+        lm_weight (float): Weight of the language model's log probability
+        prune (float): Labels below this probability at a timestep are skipped
+    Return:
+        List of N texts
+    """
+    texts = []
+    for row in probs:
+        labels = _prefix_beam_search(row, beam_width, lm, lm_weight, prune)
+        texts.append(clean_text("".join(char_list[label] for label in labels)))
+    return texts
+
+
+def _logaddexp(a, b):
+    # Scalar log(exp(a) + exp(b)); much cheaper than np.logaddexp on floats
+    if a == NEG_INF:
+        return b
+    if b == NEG_INF:
+        return a
+    if a > b:
+        return a + math.log1p(math.exp(b - a))
+    return b + math.log1p(math.exp(a - b))
+
+
+def _prefix_beam_search(probs, beam_width, lm, lm_weight, prune):
+    blank = probs.shape[-1] - 1
+    log_probs = np.log(probs + 1e-12).tolist()
+
+    width = min(beam_width, probs.shape[-1])
+
+    # prefix -> [log p(prefix, ending in blank), log p(prefix, ending in a label)]
+    beams = {(): [0.0, NEG_INF]}
+    for t in range(probs.shape[0]):
+        step = log_probs[t]
+        # Only the beam_width most likely labels of this timestep can extend a prefix
+        top = np.argpartition(probs[t], -width)[-width:]
+        candidates = {int(label) for label in top if probs[t, label] >= prune and label != blank}
+
+        next_beams = defaultdict(lambda: [NEG_INF, NEG_INF])
+        for prefix, (p_blank, p_label) in beams.items():
+            p_total = _logaddexp(p_blank, p_label)
+
+            # Emit blank: the prefix is unchanged and now ends in blank
+            entry = next_beams[prefix]
+            entry[0] = _logaddexp(entry[0], p_total + step[blank])
+
+            last = prefix[-1] if prefix else None
+            if last is not None:
+                # Repeat the last label without a blank: collapses into the same prefix
+                entry[1] = _logaddexp(entry[1], p_label + step[last])
+
+            for label in candidates:
+                bonus = lm_weight * lm.log_prob(prefix, label) if lm is not None else 0.0
+                extended = next_beams[prefix + (label,)]
+                if label == last:
+                    # A repeated label only starts a new character after a blank
+                    extended[1] = _logaddexp(extended[1], p_blank + step[label] + bonus)
+                else:
+                    extended[1] = _logaddexp(extended[1], p_total + step[label] + bonus)
+
+        ranked = sorted(next_beams.items(), key=lambda item: _logaddexp(*item[1]), reverse=True)
+        beams = dict(ranked[:beam_width])
+
+    return max(beams.items(), key=lambda item: _logaddexp(*item[1]))[0]
+
+
+class CharLanguageModel:
+    """Character n-gram model over the CRNN's alphabet, with add-k smoothing.
+
+    Characters outside ``char_list`` are dropped from the training text, so
+    the model only scores labels the CRNN can produce.
+
+    Args:
+        char_list (str): Characters the CRNN was trained on.
+        order (int): n-gram order (3 conditions on the previous two characters).
+        k (float): Additive smoothing constant.
+    """
+
+    def __init__(self, char_list, order=3, k=0.1):
+        self.char_list = char_list
+        self.order = order
+        self.k = k
+        self._index = {char: i for i, char in enumerate(char_list)}
+        self._counts = defaultdict(Counter)
+        self._cache = {}
+
+    @classmethod
+    def from_texts(cls, texts, char_list, order=3, k=0.1):
+        lm = cls(char_list, order=order, k=k)
+        for text in texts:
+            lm.add_text(text)
+        return lm
+
+    @classmethod
+    def from_lexicon(cls, words, char_list, order=3, k=0.1):
+        """Bias decoding towards a word list (each word seen once, space-separated)"""
+        return cls.from_texts([f" {word} " for word in words], char_list, order=order, k=k)
+
+    @classmethod
+    def from_file(cls, path, char_list, order=3, k=0.1):
+        """Train on a UTF-8 text file, one sentence or word per line"""
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls.from_texts(f, char_list, order=order, k=k)
+
+    def add_text(self, text):
+        labels = [self._index[char] for char in text.strip() if char in self._index]
+        for i, label in enumerate(labels):
+            context = tuple(labels[max(0, i - self.order + 1):i])
+            self._counts[context][label] += 1
+        self._cache.clear()
+
+    def log_prob(self, prefix, label):
+        """log P(label | last order-1 labels of prefix)"""
+        context = tuple(prefix[-(self.order - 1):]) if self.order > 1 else ()
+        key = (context, label)
+        if key not in self._cache:
+            counts = self._counts.get(context)
+            total = sum(counts.values()) if counts else 0
+            seen = counts[label] if counts else 0
+            self._cache[key] = math.log((seen + self.k) / (total + self.k * len(self.char_list)))
+        return self._cache[key]
+
+
+def get_decoder(name='greedy', beam_width=10, lm=None, lm_weight=0.5):
+    """Return a decode(probs, char_list) -> texts callable by name
+    Args:
+        name (str): 'greedy', 'beam' or 'tf' (Keras' K.ctc_decode)
+    """
+    if name == 'greedy':
+        return greedy_decode
+    if name == 'beam':
+        return lambda probs, char_list: beam_search_decode(probs, char_list, beam_width=beam_width,
+                                                           lm=lm, lm_weight=lm_weight)
+    if name == 'tf':
+        from notebook.RCNNMdoels import ctc_decode_tf
+        return ctc_decode_tf
+    raise ValueError(f"Unknown CTC decoder: {name}")
+
+
+_language_model = None
+_language_model_lock = threading.Lock()
+
+
+def get_language_model(char_list):
+    """Character LM trained on settings.OCR_LM_CORPUS_PATH, loaded once (None if unset)"""
+    global _language_model
+    from django.conf import settings
+
+    path = getattr(settings, 'OCR_LM_CORPUS_PATH', None)
+    if not path or not os.path.exists(path):
+        return None
+    if _language_model is None:
+        with _language_model_lock:
+            if _language_model is None:
+                _language_model = CharLanguageModel.from_file(path, char_list,
+                                                              order=getattr(settings, 'OCR_LM_ORDER', 3))
+    return _language_model
@@ -0,0 +1,199 @@
+"""Cross-request dynamic batching for CRNN inference.
+
+Requests handled by different threads of the same worker process (e.g.
+gunicorn ``--threads`` or ``runserver``) submit preprocessed line images to
+a shared queue. A single background thread collects them for at most
+``OCR_BATCH_MAX_WAIT_MS`` milliseconds (or until ``OCR_BATCH_MAX_SIZE``
+lines are waiting), runs them through the CRNN as one batch and resolves
+each caller's future with that line's softmax output. Callers CTC-decode
+their own lines, so each request can pick its decoder.
+"""
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+
+import numpy as np
+from django.conf import settings
+
+from notebook.instrumentation import stage
+
+
+class BatchingQueue:
+    """Collects single line images into batches for one predict call.
+
+    Args:
+        predict_fn (callable): Takes a stacked batch (N, 118, width, 1) and
+            returns its N per-line outputs.
+        max_batch_size (int): Upper bound on lines per forward pass.
+        max_wait_ms (float): How long the first queued line may wait for
+            others to join its batch.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=32, max_wait_ms=5):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+        self._stats_lock = threading.Lock()
+        self._submitted = 0
+        self._batches = 0
+        self._failed_batches = 0
+        self._batch_sizes = Counter()
+        self._queue_wait_total = 0.0
+        self._predict_time_total = 0.0
+
+    def submit(self, image):
+        """Queue one preprocessed line image and return a Future of its output."""
+        self._ensure_started()
+        future = Future()
+        self._queue.put((image, future, time.monotonic()))
+        with self._stats_lock:
+            self._submitted += 1
+        return future
+
+    def predict(self, images, timeout=None):
+        """Submit several lines and wait for all of their outputs, in order."""
+        futures = [self.submit(image) for image in images]
+        return [future.result(timeout=timeout) for future in futures]
+
+    def stats(self):
+        """Return queue depth and batch-size statistics as a dict."""
+        with self._stats_lock:
+            items = sum(size * count for size, count in self._batch_sizes.items())
+            return {
+                'queue_depth': self._queue.qsize(),
+                'submitted': self._submitted,
+                'batches': self._batches,
+                'failed_batches': self._failed_batches,
+                'mean_batch_size': items / self._batches if self._batches else 0.0,
+                'batch_size_histogram': dict(sorted(self._batch_sizes.items())),
+                'mean_queue_wait_ms': 1000.0 * self._queue_wait_total / items if items else 0.0,
+                'mean_predict_ms': 1000.0 * self._predict_time_total / self._batches if self._batches else 0.0,
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000.0,
+            }
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='ocr-batching-queue', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    if remaining <= 0:
+                        # Still take whatever is already waiting
+                        batch.append(self._queue.get_nowait())
+                    else:
+                        batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._process(batch)
+
+    def _process(self, batch):
+        # Skip lines whose caller has already given up
+        batch = [item for item in batch if item[1].set_running_or_notify_cancel()]
+
+        # Trimmed lines of different widths can't share one forward pass
+        groups = {}
+        for item in batch:
+            groups.setdefault(item[0].shape, []).append(item)
+        for items in groups.values():
+            self._predict(items)
+
+    def _predict(self, batch):
+        started = time.monotonic()
+        try:
+            outputs = self.predict_fn(np.stack([image for image, _, _ in batch]))
+        except Exception as e:
+            for _, future, _ in batch:
+                future.set_exception(e)
+            with self._stats_lock:
+                self._failed_batches += 1
+            return
+        finished = time.monotonic()
+
+        for (_, future, _), output in zip(batch, outputs):
+            future.set_result(output)
+
+        with self._stats_lock:
+            self._batches += 1
+            self._batch_sizes[len(batch)] += 1
+            self._queue_wait_total += sum(started - queued_at for _, _, queued_at in batch)
+            self._predict_time_total += finished - started
+
+
+_inference_queue = None
+_inference_queue_lock = threading.Lock()
+
+
+def _predict_with_shared_model(batch):
+    from notebook.model_registry import get_ocr_model
+    model = get_ocr_model()
+    with stage('inference'):
+        return model.predict(batch, batch_size=len(batch), verbose=0)
+
+
+def get_inference_queue():
+    """Return the process-wide batching queue, creating it on first use."""
+    global _inference_queue
+    if _inference_queue is None:
+        with _inference_queue_lock:
+            if _inference_queue is None:
+                _inference_queue = BatchingQueue(
+                    _predict_with_shared_model,
+                    max_batch_size=getattr(settings, 'OCR_BATCH_MAX_SIZE', 32),
+                    max_wait_ms=getattr(settings, 'OCR_BATCH_MAX_WAIT_MS', 5),
+                )
+    return _inference_queue
+
+
+def iter_text_from_arrays_queued(images, timeout=None, decoder=None):
+    """Like ``iter_text_from_arrays`` but batched across concurrent requests.
+
+    Each line is submitted as soon as it is preprocessed, so inference of the
+    first lines overlaps with reading the rest; (line index, text) pairs are
+    yielded in line order as each queued line finishes.
+    """
+    from notebook.ctc_decoder import greedy_decode
+    from notebook.RCNNMdoels import PreprocessData, WIDTH_BUCKETS, char_list, trimmed_width
+
+    variable_width = getattr(settings, 'OCR_VARIABLE_WIDTH', False)
+    inference_queue = get_inference_queue()
+    futures = []
+    for index, img in enumerate(images):
+        if img is None:
+            futures.append((index, None))
+            continue
+        with stage('preprocess'):
+            processed = PreprocessData(img)
+        if variable_width:
+            processed = processed[:, :trimmed_width(processed, WIDTH_BUCKETS)]
+        futures.append((index, inference_queue.submit(processed)))
+
+    for index, future in futures:
+        if future is None:
+            yield index, ""
+            continue
+        try:
+            output = future.result(timeout=timeout)
+        except Exception as e:
+            print(f"Error extracting text from line {index}: {str(e)}")
+            yield index, ""
+            continue
+        with stage('ctc_decode'):
+            text = (decoder or greedy_decode)(output[np.newaxis], char_list)[0]
+        yield index, text
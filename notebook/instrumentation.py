@@ -0,0 +1,196 @@
+"""Per-stage timing of requests: Server-Timing headers, log lines and /metrics.
+
+Code marks the stages it wants timed with ``stage("name")`` (a context
+manager) or ``@timed("name")``. While ``STAGE_TIMING_ENABLED`` is on, each
+stage's duration goes to
+
+* the current request, which ``StageTimingMiddleware`` reports in a
+  ``Server-Timing`` header (total duration and count per stage) and in one
+  JSON log line on the ``notebook.timing`` logger,
+* a process-wide histogram per stage, served with request durations per
+  view in Prometheus' text format by the ``metrics`` view.
+
+Stages run outside a request (ocr_worker, the batching queue's thread, the
+body of a streamed response) only reach the histograms. Histograms are per
+process: with several gunicorn workers each one is scraped separately or
+through the proxy of your choice.
+
+When timing is disabled ``stage`` returns a shared no-op context manager,
+so the only cost left is one settings lookup.
+"""
+import contextlib
+import contextvars
+import functools
+import json
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger('notebook.timing')
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# {stage: [seconds, count]} of the request being handled, None outside one
+_request_stages = contextvars.ContextVar('request_stages', default=None)
+_noop = contextlib.nullcontext()
+
+
+def timing_enabled():
+    return getattr(settings, 'STAGE_TIMING_ENABLED', False)
+
+
+class Histogram:
+    """Cumulative Prometheus-style histogram with one series per label value.
+
+    Args:
+        name (str): Metric name.
+        label (str): Name of the label telling series apart (e.g. "stage").
+        buckets (tuple): Upper bounds in seconds, ascending.
+    """
+
+    def __init__(self, name, label, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.label = label
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self._series = {}  # label value -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, seconds):
+        with self._lock:
+            series = self._series.get(value)
+            if series is None:
+                series = self._series[value] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series[i] += 1
+            series[-2] += seconds
+            series[-1] += 1
+
+    def render(self):
+        """Lines of the Prometheus text exposition format"""
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {value: list(counts) for value, counts in self._series.items()}
+        for value, counts in sorted(series.items()):
+            label = f'{self.label}="{_escape_label(value)}"'
+            for bound, count in zip(self.buckets, counts):
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {counts[-1]}')
+            lines.append(f'{self.name}_sum{{{label}}} {counts[-2]:.6f}')
+            lines.append(f'{self.name}_count{{{label}}} {counts[-1]}')
+        return lines
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+_buckets = getattr(settings, 'STAGE_TIMING_BUCKETS', DEFAULT_BUCKETS)
+STAGE_SECONDS = Histogram('notebook_stage_duration_seconds', 'stage',
+                          'Time spent in each stage of request handling and OCR', _buckets)
+REQUEST_SECONDS = Histogram('notebook_request_duration_seconds', 'view',
+                            'Time to produce a response, by view', _buckets)
+
+
+def record(name, seconds):
+    """Add a measured duration to the current request and the stage histogram"""
+    STAGE_SECONDS.observe(name, seconds)
+    stages = _request_stages.get()
+    if stages is not None:
+        totals = stages.setdefault(name, [0.0, 0])
+        totals[0] += seconds
+        totals[1] += 1
+
+
+@contextlib.contextmanager
+def _timer(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - started)
+
+
+def stage(name):
+    """Context manager timing the code it wraps as stage name"""
+    if not timing_enabled():
+        return _noop
+    return _timer(name)
+
+
+def timed(name):
+    """Decorator timing every call of a function as stage name"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not timing_enabled():
+                return func(*args, **kwargs)
+            with _timer(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _time_query(execute, sql, params, many, context):
+    with _timer('db'):
+        return execute(sql, params, many, context)
+
+
+def server_timing(stages, total):
+    """Server-Timing header value: one entry per stage, then the total"""
+    entries = [f'{name};dur={seconds * 1000:.1f};desc="{count}x"' for name, (seconds, count) in stages.items()]
+    entries.append(f'total;dur={total * 1000:.1f}')
+    return ', '.join(entries)
+
+
+class StageTimingMiddleware:
+    """Times each request and reports its stages (see the module docstring)
+
+    Queries on the default database are timed as the "db" stage.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not timing_enabled():
+            return self.get_response(request)
+
+        stages = {}
+        token = _request_stages.set(stages)
+        started = time.perf_counter()
+        try:
+            with connection.execute_wrapper(_time_query):
+                response = self.get_response(request)
+        finally:
+            _request_stages.reset(token)
+        total = time.perf_counter() - started
+
+        match = request.resolver_match
+        view = match.view_name if match is not None else 'unmatched'
+        REQUEST_SECONDS.observe(view, total)
+        response['Server-Timing'] = server_timing(stages, total)
+        logger.info(json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'view': view,
+            'status': response.status_code,
+            'streaming': response.streaming,
+            'total_ms': round(total * 1000, 1),
+            'stages': {name: {'ms': round(seconds * 1000, 1), 'count': count}
+                       for name, (seconds, count) in stages.items()},
+        }))
+        return response
+
+
+def render_metrics():
+    """All histograms in Prometheus' text format"""
+    return '\n'.join(STAGE_SECONDS.render() + REQUEST_SECONDS.render()) + '\n'
@@ -0,0 +1,60 @@
+import glob
+import os
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from notebook.benchmarks import synthetic_outputs
+from notebook.ctc_decoder import CharLanguageModel, get_decoder
+from notebook.ocr_metrics import character_error_rate
+
+
+class Command(BaseCommand):
+    help = "Compare speed and CER of the NumPy CTC decoders against K.ctc_decode"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lines', type=int, default=64, help='Synthetic lines to decode')
+        parser.add_argument('--noise', type=float, default=1.5)
+        parser.add_argument('--lines-dir', default=None,
+                            help='Decode real CRNN outputs for line_*.png here instead (reference: tf decoder)')
+        parser.add_argument('--beam-widths', default='5,10', help='Comma-separated beam widths')
+        parser.add_argument('--lm-corpus', default=None, help='Text file for a character LM used by beam search')
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        from notebook.RCNNMdoels import char_list
+
+        if options['lines_dir']:
+            import cv2
+            from notebook.model_registry import load_ocr_model
+            from notebook.RCNNMdoels import PreprocessData
+
+            paths = sorted(glob.glob(os.path.join(options['lines_dir'], '**', 'line_*.png'), recursive=True))
+            if not paths:
+                raise CommandError(f"No line images in {options['lines_dir']}")
+            batch = np.stack([PreprocessData(cv2.imread(path)) for path in paths])
+            probs = load_ocr_model().predict(batch, verbose=0)
+            references = get_decoder('tf')(probs, char_list)
+            self.stdout.write(f"{len(paths)} real lines, reference = tf decoder")
+        else:
+            references, probs = synthetic_outputs(char_list, options['lines'], noise=options['noise'])
+            self.stdout.write(f"{len(references)} synthetic lines, reference = ground truth")
+
+        lm = CharLanguageModel.from_file(options['lm_corpus'], char_list) if options['lm_corpus'] else None
+
+        decoders = [('tf', get_decoder('tf')), ('greedy', get_decoder('greedy'))]
+        for width in options['beam_widths'].split(','):
+            decoders.append((f'beam{width}', get_decoder('beam', beam_width=int(width))))
+            if lm is not None:
+                decoders.append((f'beam{width}+lm', get_decoder('beam', beam_width=int(width), lm=lm)))
+
+        self.stdout.write(f"{'decoder':<14}{'ms/line':>10}{'CER':>10}")
+        for name, decode in decoders:
+            timings = []
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                texts = decode(probs, char_list)
+                timings.append(time.perf_counter() - started)
+            per_line = 1000 * min(timings) / len(probs)
+            self.stdout.write(f"{name:<14}{per_line:>10.3f}{character_error_rate(references, texts):>10.4f}")
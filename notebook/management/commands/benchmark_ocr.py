@@ -0,0 +1,136 @@
+import base64
+import json
+import os
+import platform
+import shutil
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory, override_settings
+
+from notebook.benchmarks import compare, measure, synthetic_lines, synthetic_outputs
+
+BENCHMARKS = ('preprocess', 'crnn', 'ctc', 'correction', 'save_lines')
+
+
+class Command(BaseCommand):
+    help = "Time the OCR hot path on synthetic lines and compare with an earlier run"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--only', default=','.join(BENCHMARKS),
+                            help=f"Comma-separated benchmarks: {', '.join(BENCHMARKS)}")
+        parser.add_argument('--lines', type=int, default=32, help='Synthetic lines per call')
+        parser.add_argument('--repeat', type=int, default=10)
+        parser.add_argument('--batch-sizes', default='1,8,32', help='CRNN batch sizes')
+        parser.add_argument('--weights', action='store_true',
+                            help='Load the real CRNN weights instead of a randomly initialized model')
+        parser.add_argument('--output', default=None, help='Write the results to this JSON file')
+        parser.add_argument('--compare', default=None, help='Results JSON of an earlier run')
+        parser.add_argument('--max-slowdown', type=float, default=0.1,
+                            help='Fail when a p50 is this much slower than in --compare (0.1 = 10%%)')
+
+    def handle(self, *args, **options):
+        selected = [name for name in options['only'].split(',') if name]
+        unknown = set(selected) - set(BENCHMARKS)
+        if unknown:
+            raise CommandError(f"Unknown benchmarks: {', '.join(sorted(unknown))}")
+
+        self.lines = synthetic_lines(options['lines'])
+        self.options = options
+        results = {}
+        # Cached results would make repeated calls free
+        with override_settings(OCR_CACHE_ENABLED=False):
+            for name in selected:
+                for key, result in getattr(self, f'bench_{name}')():
+                    results[key] = result
+                    if 'skipped' in result:
+                        self.stdout.write(f"{key:<16} skipped: {result['skipped']}")
+                    else:
+                        self.stdout.write(f"{key:<16}{result['p50_ms']:>10.2f} ms p50{result['p95_ms']:>10.2f} ms p95"
+                                          f"{result['items_per_s']:>10.1f}/s{result['peak_rss_mb']:>9.0f} MB")
+
+        run = {
+            'meta': {'date': datetime.now().isoformat(timespec='seconds'), 'python': platform.python_version(),
+                     'machine': platform.machine(), 'cpus': os.cpu_count(), 'lines': options['lines'],
+                     'repeat': options['repeat'], 'weights': options['weights']},
+            'results': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(run, f, indent=2)
+            self.stdout.write(f"Saved {options['output']}")
+
+        if options['compare']:
+            with open(options['compare'], 'r', encoding='utf-8') as f:
+                baseline = json.load(f)
+            regressions = compare(baseline['results'], results, max_slowdown=options['max_slowdown'])
+            for name, before, after, change in regressions:
+                self.stderr.write(f"{name}: {before:.2f} -> {after:.2f} ms p50 (+{change:.0%})")
+            if regressions:
+                raise CommandError(f"{len(regressions)} benchmark(s) slower than {options['max_slowdown']:.0%}")
+            self.stdout.write(f"No slowdowns above {options['max_slowdown']:.0%} vs {options['compare']}")
+
+    def bench_preprocess(self):
+        from notebook.RCNNMdoels import PreprocessData
+
+        def run():
+            for line in self.lines:
+                PreprocessData(line)
+
+        yield 'preprocess', measure(run, items=len(self.lines), repeat=self.options['repeat'])
+
+    def bench_crnn(self):
+        import numpy as np
+
+        from notebook.RCNNMdoels import PreprocessData, build_crnn
+
+        if self.options['weights']:
+            from notebook.model_registry import load_ocr_model
+            model = load_ocr_model()
+        else:
+            model = build_crnn()
+        preprocessed = np.stack([PreprocessData(line) for line in self.lines])
+
+        for batch_size in (int(size) for size in self.options['batch_sizes'].split(',')):
+            batch = np.resize(preprocessed, (batch_size,) + preprocessed.shape[1:])
+            yield f'crnn_b{batch_size}', measure(lambda: model.predict(batch, batch_size=batch_size, verbose=0),
+                                                 items=batch_size, repeat=self.options['repeat'])
+
+    def bench_ctc(self):
+        from notebook.alphabet import char_list
+        from notebook.ctc_decoder import get_decoder
+
+        _, probs = synthetic_outputs(char_list, len(self.lines))
+        for name, decoder in (('ctc_greedy', get_decoder('greedy')), ('ctc_beam10', get_decoder('beam'))):
+            yield name, measure(lambda: decoder(probs, char_list), items=len(probs), repeat=self.options['repeat'])
+
+    def bench_correction(self):
+        from notebook.alphabet import char_list
+        from notebook.NLPprocess import correct_ocr_lines, get_correction_service
+
+        try:
+            get_correction_service().load()
+        except Exception as e:
+            yield 'correction', {'skipped': f"ViT5 not available ({e})"}
+            return
+        texts, _ = synthetic_outputs(char_list, len(self.lines), timesteps=120)
+        yield 'correction', measure(lambda: correct_ocr_lines(texts), items=len(texts),
+                                    repeat=max(1, self.options['repeat'] // 5))
+
+    def bench_save_lines(self):
+        import cv2
+
+        from notebook.views import save_notebook_lines
+
+        data_urls = []
+        for line in self.lines:
+            _, encoded = cv2.imencode('.png', line)
+            data_urls.append('data:image/png;base64,' + base64.b64encode(encoded.tobytes()).decode('ascii'))
+        body = json.dumps({'images': [{'lineNumber': i + 1, 'dataURL': url} for i, url in enumerate(data_urls)]})
+        factory = RequestFactory()
+
+        def run():
+            response = save_notebook_lines(factory.post('/save-lines/', body, content_type='application/json'))
+            shutil.rmtree(json.loads(response.content)['folder_path'], ignore_errors=True)
+
+        yield 'save_lines', measure(run, items=len(data_urls), repeat=self.options['repeat'])
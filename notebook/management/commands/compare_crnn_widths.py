@@ -0,0 +1,83 @@
+import os
+import time
+
+import cv2
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from notebook.model_registry import load_ocr_model
+from notebook.ocr_metrics import character_error_rate
+from notebook.segmentation import split_ruled_lines
+from notebook.RCNNMdoels import (WIDTH_BUCKETS, char_list, extract_text_from_arrays,
+                                 ink_width, resize_line, threshold_line)
+
+
+def page_lines(image_path, line_spacing):
+    """Split an image into ruled lines the way the canvas does before OCR.
+    Files already named line_NNN.png are returned whole."""
+    img = cv2.imread(image_path)
+    if img is None:
+        return []
+    if os.path.basename(image_path).startswith('line_'):
+        return [(image_path, img)]
+
+    return [(f"{image_path}#{i + 1}", line) for i, line in enumerate(split_ruled_lines(img, line_spacing))]
+
+
+class Command(BaseCommand):
+    help = "Check that the variable-width CRNN decodes the same text as the fixed-width one"
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*',
+                            help='Folders or PNG files to check (default: BOOK_STORAGE_DIR)')
+        parser.add_argument('--line-spacing', type=int, default=90,
+                            help='Height of a ruled line when splitting page images')
+        parser.add_argument('--batch-size', type=int, default=getattr(settings, 'OCR_BATCH_SIZE', 16))
+        parser.add_argument('--show-mismatches', action='store_true')
+        parser.add_argument('--fail-on-mismatch', action='store_true')
+
+    def handle(self, *args, **options):
+        image_paths = []
+        for path in options['paths'] or [settings.BOOK_STORAGE_DIR]:
+            if os.path.isdir(path):
+                for root, _, files in os.walk(path):
+                    image_paths.extend(os.path.join(root, f) for f in sorted(files) if f.endswith('.png'))
+            else:
+                image_paths.append(path)
+
+        # Only lines with some ink say anything about parity
+        names, images = [], []
+        for image_path in image_paths:
+            for name, img in page_lines(image_path, options['line_spacing']):
+                if ink_width(threshold_line(resize_line(img))):
+                    names.append(name)
+                    images.append(img)
+        if not images:
+            raise CommandError('No lines with ink found')
+
+        fixed = load_ocr_model(warmup=True)
+        variable = load_ocr_model(variable_width=True, warmup=True)
+
+        started = time.perf_counter()
+        fixed_texts = extract_text_from_arrays(images, fixed, char_list, batch_size=options['batch_size'])
+        fixed_time = time.perf_counter() - started
+
+        started = time.perf_counter()
+        variable_texts = extract_text_from_arrays(images, variable, char_list, batch_size=options['batch_size'],
+                                                  buckets=WIDTH_BUCKETS)
+        variable_time = time.perf_counter() - started
+
+        mismatches = [(name, a, b) for name, a, b in zip(names, fixed_texts, variable_texts) if a != b]
+        if options['show_mismatches']:
+            for name, a, b in mismatches:
+                self.stdout.write(f"{name}\n  fixed:    {a}\n  variable: {b}")
+
+        self.stdout.write(f"Lines compared:   {len(images)} from {len(image_paths)} images")
+        self.stdout.write(f"Exact matches:    {len(images) - len(mismatches)}/{len(images)}")
+        self.stdout.write(f"CER vs fixed:     {character_error_rate(fixed_texts, variable_texts):.4f}")
+        self.stdout.write(f"Fixed width:      {fixed_time:.2f}s")
+        self.stdout.write(f"Variable width:   {variable_time:.2f}s "
+                          f"({fixed_time / variable_time if variable_time else 0:.2f}x)")
+
+        if mismatches and options['fail_on_mismatch']:
+            raise CommandError(f'{len(mismatches)} lines decoded differently')
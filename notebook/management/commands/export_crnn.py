@@ -0,0 +1,100 @@
+import glob
+import os
+import random
+import time
+
+import cv2
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from notebook.model_registry import get_weights_path, load_ocr_model, load_tflite_model
+from notebook.ocr_metrics import character_error_rate
+from notebook.RCNNMdoels import PreprocessData, char_list, extract_text_from_arrays
+
+
+class Command(BaseCommand):
+    help = ("Convert the CRNN and its checkpoint into a frozen TFLite artifact "
+            "(BatchNormalization folded, optionally quantized) and report CER and latency "
+            "against the Keras model")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=getattr(settings, 'OCR_TFLITE_PATH',
+                                                        os.path.join(settings.BASE_DIR, 'model_crnn.tflite')))
+        parser.add_argument('--weights', default=None, help='Checkpoint to convert (default: OCR_WEIGHTS_PATH)')
+        parser.add_argument('--quantize', choices=['none', 'dynamic', 'int8'], default='none',
+                            help='dynamic: int8 weights; int8: also int8 activations, calibrated on saved lines')
+        parser.add_argument('--variable-width', action='store_true',
+                            help='Export the dynamic-width graph used with OCR_VARIABLE_WIDTH')
+        parser.add_argument('--lines-dir', default=os.path.join(settings.BASE_DIR, 'notebook_lines'),
+                            help='Folder of saved line_NNN.png images used for calibration and the report')
+        parser.add_argument('--calibration-samples', type=int, default=100)
+        parser.add_argument('--eval-samples', type=int, default=100)
+        parser.add_argument('--skip-report', action='store_true')
+
+    def handle(self, *args, **options):
+        import tensorflow as tf
+
+        weights_path = options['weights'] or get_weights_path()
+        if not os.path.exists(weights_path):
+            raise CommandError(f'Weights not found: {weights_path}')
+
+        line_paths = sorted(glob.glob(os.path.join(options['lines_dir'], '**', 'line_*.png'), recursive=True))
+        random.Random(0).shuffle(line_paths)
+        calibration_paths = line_paths[:options['calibration_samples']]
+        eval_paths = line_paths[options['calibration_samples']:][:options['eval_samples']] or calibration_paths
+
+        model = load_ocr_model(weights_path, variable_width=options['variable_width'])
+
+        # The converter folds BatchNormalization into the preceding convolutions
+        converter = tf.lite.TFLiteConverter.from_keras_model(model)
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS, tf.lite.OpsSet.SELECT_TF_OPS]
+
+        if options['quantize'] in ('dynamic', 'int8'):
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        if options['quantize'] == 'int8':
+            if not calibration_paths:
+                raise CommandError(f"int8 needs saved line images for calibration in {options['lines_dir']}")
+
+            def representative_dataset():
+                for path in calibration_paths:
+                    img = cv2.imread(path)
+                    if img is not None:
+                        yield [np.expand_dims(PreprocessData(img), axis=0)]
+
+            converter.representative_dataset = representative_dataset
+
+        started = time.perf_counter()
+        tflite_model = converter.convert()
+        with open(options['output'], 'wb') as f:
+            f.write(tflite_model)
+        self.stdout.write(f"Wrote {options['output']} ({len(tflite_model) / 1e6:.1f} MB, "
+                          f"quantize={options['quantize']}) in {time.perf_counter() - started:.1f}s")
+
+        if options['skip_report']:
+            return
+        backend = load_tflite_model(options['output'])
+
+        if not eval_paths:
+            self.stdout.write(f"No line images in {options['lines_dir']}; skipping accuracy report")
+        else:
+            eval_images = [cv2.imread(path) for path in eval_paths]
+            keras_texts = extract_text_from_arrays(eval_images, model, char_list)
+            tflite_texts = extract_text_from_arrays(eval_images, backend, char_list)
+            changed = sum(a != b for a, b in zip(keras_texts, tflite_texts))
+            self.stdout.write(f"Accuracy on {len(eval_images)} lines: CER delta vs Keras "
+                              f"{character_error_rate(keras_texts, tflite_texts):.4f}, "
+                              f"{changed} lines decoded differently")
+
+        # Latency of the forward pass alone
+        for batch_size in (1, 8):
+            batch = np.zeros((batch_size, 118, 2167, 1), dtype=np.float32)
+            for name, runner in (('keras', model), ('tflite', backend)):
+                runner.predict(batch, batch_size=batch_size, verbose=0)
+                timings = []
+                for _ in range(5):
+                    started = time.perf_counter()
+                    runner.predict(batch, batch_size=batch_size, verbose=0)
+                    timings.append(time.perf_counter() - started)
+                self.stdout.write(f"Latency batch={batch_size:<2} {name:<6} "
+                                  f"median {1000 * float(np.median(timings)):.1f} ms")
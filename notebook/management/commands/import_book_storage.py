@@ -0,0 +1,35 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from notebook.utils import import_book_folder
+
+
+class Command(BaseCommand):
+    help = "Import book_storage/<book>/data.json folders into the Book and Page tables"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--storage-dir', default=None, help='Defaults to settings.BOOK_STORAGE_DIR')
+
+    def handle(self, *args, **options):
+        storage_dir = options['storage_dir'] or settings.BOOK_STORAGE_DIR
+        if not os.path.isdir(storage_dir):
+            raise CommandError(f"No book storage at {storage_dir}")
+
+        created = updated = skipped = 0
+        for folder_name in sorted(os.listdir(storage_dir)):
+            folder_path = os.path.join(storage_dir, folder_name)
+            if not os.path.isfile(os.path.join(folder_path, 'data.json')):
+                continue
+            try:
+                book, is_new = import_book_folder(folder_path)
+            except Exception as e:
+                self.stderr.write(f"Skipped {folder_name}: {e}")
+                skipped += 1
+                continue
+            created += is_new
+            updated += not is_new
+            self.stdout.write(f"{'Created' if is_new else 'Updated'} {book.slug} ({book.pages.count()} pages)")
+
+        self.stdout.write(f"{created} created, {updated} updated, {skipped} skipped")
@@ -0,0 +1,81 @@
+import json
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Run in a fresh interpreter per role, so nothing this command imported counts
+PROBE = r"""
+import json, os, sys, time
+started = time.perf_counter()
+
+import django
+django.setup()
+from django.urls import get_resolver
+get_resolver().url_patterns  # imports the URLconf and the views, like a worker's first request
+ready = time.perf_counter() - started
+
+from django.test import Client
+from notebook.benchmarks import peak_rss_mb
+
+result = {'role': os.environ['NOTEBOOK_ROLE'], 'ready_s': round(ready, 3)}
+started = time.perf_counter()
+if result['role'] == 'web':
+    result['first_request'] = '/api/books/'
+    result['status'] = Client().get('/api/books/').status_code
+else:
+    # What the first OCR request does: build the CRNN and load the weights
+    from notebook.model_registry import get_ocr_model
+    try:
+        get_ocr_model()
+        result['first_request'] = 'OCR model load'
+    except FileNotFoundError:
+        from notebook.RCNNMdoels import build_crnn
+        build_crnn()
+        result['first_request'] = 'CRNN build (no weights found)'
+    if os.environ.get('MEASURE_CORRECTION'):
+        from notebook.NLPprocess import get_correction_service
+        get_correction_service().load()
+        result['first_request'] += ' + ViT5 load'
+result['first_request_s'] = round(time.perf_counter() - started, 3)
+result['peak_rss_mb'] = round(peak_rss_mb(), 1)
+result['tensorflow'] = 'tensorflow' in sys.modules
+result['torch'] = 'torch' in sys.modules
+print(json.dumps(result))
+"""
+
+
+class Command(BaseCommand):
+    help = "Measure startup time and memory of a worker per NOTEBOOK_ROLE ('web' CRUD-only vs 'ocr')"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--roles', default='web,ocr', help='Comma-separated roles to measure')
+        parser.add_argument('--repeat', type=int, default=3, help='Fresh processes per role (median is kept)')
+        parser.add_argument('--correction', action='store_true', help='Also load ViT5 in the ocr role')
+
+    def handle(self, *args, **options):
+        rows = []
+        for role in options['roles'].split(','):
+            env = dict(os.environ, NOTEBOOK_ROLE=role)
+            if options['correction']:
+                env['MEASURE_CORRECTION'] = '1'
+            runs = []
+            for _ in range(options['repeat']):
+                completed = subprocess.run([sys.executable, '-c', PROBE], cwd=settings.BASE_DIR, env=env,
+                                           capture_output=True, text=True)
+                if completed.returncode != 0:
+                    raise CommandError(f"{role} worker failed:\n{completed.stderr}")
+                runs.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+            runs.sort(key=lambda run: run['ready_s'] + run['first_request_s'])
+            rows.append(runs[len(runs) // 2])
+
+        self.stdout.write(f"{'role':<6}{'ready':>9}{'first req':>11}{'peak RSS':>11}  tensorflow  torch  first request")
+        for row in rows:
+            self.stdout.write(f"{row['role']:<6}{row['ready_s']:>8.2f}s{row['first_request_s']:>10.2f}s"
+                              f"{row['peak_rss_mb']:>8.0f} MB  {str(row['tensorflow']):<10}  {str(row['torch']):<5}  "
+                              f"{row['first_request']}")
+        for row in rows:
+            if row['role'] == 'web' and (row['tensorflow'] or row['torch']):
+                raise CommandError("The web role imported TensorFlow or torch")
@@ -0,0 +1,211 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Set in each worker process by _init_worker
+_worker = {}
+
+
+def _init_worker(options):
+    """Load the models once per worker process
+    A load error is kept and reported for every page given to the worker:
+    an exception here would make the pool respawn workers forever.
+    """
+    # Split the cores between workers; must happen before TensorFlow/torch start
+    threads = str(options['threads'])
+    for name in ('OMP_NUM_THREADS', 'TF_NUM_INTRAOP_THREADS', 'TF_NUM_INTEROP_THREADS'):
+        os.environ[name] = threads
+
+    import django
+    django.setup()
+
+    from notebook.model_registry import get_ocr_model
+    from notebook.NLPprocess import get_correction_service
+    from notebook.ocr_service import get_request_decoder, recognition_context
+
+    _worker['options'] = options
+    try:
+        _worker['model'] = get_ocr_model()
+        _worker['decoder'], decoder_key = get_request_decoder({'decoder': options['decoder']})
+        _worker['cache_context'] = recognition_context(decoder_key)
+        if options['correct']:
+            service = get_correction_service()
+            service.num_threads = options['threads']
+            _worker['correction'] = service.load()
+    except Exception as e:
+        _worker['error'] = f"Worker could not load the models: {e}"
+
+
+def _load_lines(task):
+    """Decode and segment one page (runs ahead of the model in a thread)"""
+    import cv2
+
+    from notebook.segmentation import segment_page, split_ruled_lines, to_bgr
+
+    image = cv2.imread(task['image_path'], cv2.IMREAD_UNCHANGED)
+    if image is None:
+        return None
+    if _worker['options']['segmentation'] == 'ruled':
+        return split_ruled_lines(to_bgr(image))
+    return segment_page(image)
+
+
+def ocr_pages(tasks):
+    """Recognize and correct a chunk of pages
+    Lines of several pages share CRNN batches; the next pages are decoded and
+    segmented while the current batch runs.
+    Return:
+        One result dict per page
+    """
+    from notebook.RCNNMdoels import char_list, extract_text_from_arrays
+    from notebook.result_cache import get_cache
+
+    if 'error' in _worker:
+        return [dict(task, error=_worker['error']) for task in tasks]
+
+    options = _worker['options']
+    results = []
+    pending = []  # (task, lines) waiting for a batch
+
+    def flush():
+        images = [line for _, lines in pending for line in lines]
+        texts = extract_text_from_arrays(images, _worker['model'], char_list,
+                                         batch_size=options['batch_size'], decoder=_worker['decoder'],
+                                         cache=get_cache('crnn'), cache_context=_worker['cache_context'])
+        offset = 0
+        for task, lines in pending:
+            line_texts = [text for text in texts[offset:offset + len(lines)] if text.strip()]
+            offset += len(lines)
+            try:
+                text = _worker['correction'].correct_lines(line_texts) if 'correction' in _worker else ' '.join(line_texts)
+            except Exception as e:
+                results.append(dict(task, error=f"Correction failed: {e}"))
+                continue
+            results.append(dict(task, lines=len(lines), original_text=' '.join(line_texts), text=text))
+        pending.clear()
+
+    with ThreadPoolExecutor(max_workers=options['prefetch']) as executor:
+        for task, lines in zip(tasks, executor.map(_load_lines, tasks)):
+            if lines is None:
+                results.append(dict(task, error='Page image not found'))
+                continue
+            pending.append((task, lines))
+            if sum(len(page_lines) for _, page_lines in pending) >= options['batch_size']:
+                flush()
+        if pending:
+            flush()
+    return results
+
+
+def _checkpoint_key(task):
+    return f"{task['book']}/{task['page_id']}@{task['content_hash']}"
+
+
+class Command(BaseCommand):
+    help = "OCR every saved page (or those of the given books) with a pool of worker processes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('book_ids', nargs='*', help='Books to OCR (default: all)')
+        parser.add_argument('--processes', type=int, default=os.cpu_count() or 1,
+                            help='Worker processes, each loading the CRNN and ViT5 once')
+        parser.add_argument('--threads', type=int, default=None,
+                            help='Compute threads per worker (default: cores / processes)')
+        parser.add_argument('--batch-size', type=int, default=getattr(settings, 'OCR_BATCH_SIZE', 16))
+        parser.add_argument('--pages-per-task', type=int, default=8,
+                            help='Pages sent to a worker at a time')
+        parser.add_argument('--prefetch', type=int, default=2,
+                            help='Threads per worker decoding and segmenting upcoming pages')
+        parser.add_argument('--segmentation', choices=['profile', 'ruled'], default='profile')
+        parser.add_argument('--decoder', default=getattr(settings, 'OCR_CTC_DECODER', 'greedy'))
+        parser.add_argument('--no-correction', action='store_true', help="Store the CRNN text without ViT5")
+        parser.add_argument('--checkpoint', default=os.path.join(settings.BASE_DIR, 'ocr_books.checkpoint'),
+                            help='File of pages already done, so an interrupted run resumes')
+        parser.add_argument('--restart', action='store_true', help='Ignore the checkpoint and redo every page')
+
+    def handle(self, *args, **options):
+        from notebook.models import Book, Page
+        from notebook.page_blobs import content_hash
+        from notebook.stroke_log import compact_book
+        from notebook.utils import store_page_text
+
+        books = Book.objects.all()
+        if options['book_ids']:
+            books = books.filter(slug__in=options['book_ids'])
+            missing = set(options['book_ids']) - set(books.values_list('slug', flat=True))
+            if missing:
+                raise CommandError(f"Unknown books: {', '.join(sorted(missing))} (run import_book_storage first?)")
+        # Fail here rather than in every worker process
+        from notebook.model_registry import get_model_path
+        if not os.path.exists(get_model_path()):
+            raise CommandError(f"OCR model not found: {get_model_path()}")
+        if not options['no_correction']:
+            from notebook.NLPprocess import get_correction_service
+            model_path = get_correction_service().model_path
+            # Relative names may be hub models, which only loading can check
+            if os.path.isabs(model_path) and not os.path.exists(model_path):
+                raise CommandError(f"ViT5 model not found: {model_path} (or pass --no-correction)")
+
+        for book in books:
+            compact_book(book)
+
+        done = set()
+        if os.path.exists(options['checkpoint']) and not options['restart']:
+            with open(options['checkpoint'], 'r', encoding='utf-8') as f:
+                done = {line.strip() for line in f if line.strip()}
+
+        tasks = []
+        for page in Page.objects.filter(book__in=books).select_related('book').order_by('book_id', 'position'):
+            image_path = os.path.join(settings.BOOK_STORAGE_DIR, page.book.slug, f"page-{page.page_id}.png")
+            if not os.path.exists(image_path):
+                continue
+            digest = page.content_hash
+            if not digest:
+                with open(image_path, 'rb') as f:
+                    digest = content_hash(f.read())
+            task = {'book': page.book.slug, 'page_id': page.page_id, 'image_path': image_path, 'content_hash': digest}
+            if _checkpoint_key(task) not in done:
+                tasks.append(task)
+
+        if not tasks:
+            self.stdout.write("Nothing to do")
+            return
+
+        processes = max(1, min(options['processes'], len(tasks)))
+        worker_options = {
+            'threads': options['threads'] or max(1, (os.cpu_count() or 1) // processes),
+            'batch_size': options['batch_size'],
+            'prefetch': options['prefetch'],
+            'segmentation': options['segmentation'],
+            'decoder': options['decoder'],
+            'correct': not options['no_correction'],
+        }
+        chunks = [tasks[i:i + options['pages_per_task']] for i in range(0, len(tasks), options['pages_per_task'])]
+        self.stdout.write(f"{len(tasks)} pages, {processes} workers x {worker_options['threads']} threads")
+
+        started = time.perf_counter()
+        completed = failed = 0
+        # spawn rather than fork: TensorFlow and torch don't survive a fork once loaded
+        context = multiprocessing.get_context('spawn')
+        with context.Pool(processes, initializer=_init_worker, initargs=(worker_options,)) as pool, \
+                open(options['checkpoint'], 'a', encoding='utf-8') as checkpoint:
+            for results in pool.imap_unordered(ocr_pages, chunks):
+                for result in results:
+                    if 'error' in result:
+                        failed += 1
+                        self.stderr.write(f"{result['book']}/page-{result['page_id']}: {result['error']}")
+                        continue
+                    store_page_text(result['book'], result['page_id'], result['text'])
+                    checkpoint.write(_checkpoint_key(result) + '\n')
+                    completed += 1
+                checkpoint.flush()
+
+                elapsed = time.perf_counter() - started
+                self.stdout.write(f"{completed + failed}/{len(tasks)} pages, {completed / elapsed:.2f} pages/s")
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f"Done: {completed} pages in {elapsed:.1f}s ({completed / elapsed:.2f} pages/s), "
+                          f"{failed} failed")
@@ -0,0 +1,81 @@
+import multiprocessing
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from notebook.ocr_jobs import claim_job, complete_job, fail_job, requeue_stale_jobs, run_job
+
+
+# Seconds between checks for jobs orphaned by dead workers
+REQUEUE_INTERVAL = 60
+
+
+def work(poll_interval, once=False):
+    """Claim and run jobs until stopped (or until the queue is empty when once is set)"""
+    worker = f"{os.uname().nodename}:{os.getpid()}"
+    last_requeue = time.monotonic()
+    while True:
+        if time.monotonic() - last_requeue >= REQUEUE_INTERVAL:
+            requeued = requeue_stale_jobs()
+            if requeued:
+                print(f"Requeued {requeued} stale job(s)")
+            last_requeue = time.monotonic()
+
+        job = claim_job(worker=worker)
+        if job is None:
+            if once:
+                return
+            time.sleep(poll_interval)
+            continue
+
+        started = time.perf_counter()
+        try:
+            result = run_job(job)
+        except Exception as e:
+            print(f"Job {job['job_id']} failed: {str(e)}")
+            fail_job(job, str(e))
+            continue
+        complete_job(job, result)
+        print(f"Job {job['job_id']} done: {result['lines']} lines in {time.perf_counter() - started:.1f}s")
+
+
+def _process_main(poll_interval, once):
+    # Spawned processes start from a fresh interpreter
+    import django
+    django.setup()
+    work(poll_interval, once)
+
+
+class Command(BaseCommand):
+    help = "Run OCR jobs queued by extract-text/ with \"async\": true"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=1,
+                            help='Worker processes, each loading its own CRNN and ViT5')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds to wait when the queue is empty')
+        parser.add_argument('--once', action='store_true', help='Exit when the queue is empty')
+
+    def handle(self, *args, **options):
+        requeued = requeue_stale_jobs()
+        if requeued:
+            self.stdout.write(f"Requeued {requeued} stale job(s)")
+
+        if options['processes'] <= 1:
+            work(options['poll_interval'], options['once'])
+            return
+
+        # spawn rather than fork: TensorFlow and torch don't survive a fork once loaded
+        context = multiprocessing.get_context('spawn')
+        processes = [context.Process(target=_process_main, args=(options['poll_interval'], options['once']))
+                     for _ in range(options['processes'])]
+        for process in processes:
+            process.start()
+        self.stdout.write(f"Started {len(processes)} OCR workers")
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.terminate()
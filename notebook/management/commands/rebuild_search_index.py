@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from notebook.models import Page
+from notebook.search_index import get_search_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index from the OCR text stored on pages"
+
+    def handle(self, *args, **options):
+        index = get_search_index()
+        index.clear()
+        indexed = 0
+        pages = Page.objects.exclude(extracted_text='').select_related('book').only(
+            'page_id', 'extracted_text', 'book__slug')
+        for page in pages.iterator(chunk_size=1000):
+            index.add(page.book.slug, page.page_id, page.extracted_text)
+            indexed += 1
+        self.stdout.write(f"Indexed {indexed} pages")
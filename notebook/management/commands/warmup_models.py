@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from notebook.model_registry import get_ocr_model
+from notebook.NLPprocess import get_correction_service
+
+
+class Command(BaseCommand):
+    help = "Load the CRNN and the ViT5 correction model now instead of on the first request"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--skip-ocr', action='store_true', help="Don't load the CRNN")
+        parser.add_argument('--skip-correction', action='store_true', help="Don't load ViT5")
+
+    def handle(self, *args, **options):
+        if not options['skip_ocr']:
+            started = time.perf_counter()
+            try:
+                get_ocr_model()
+            except FileNotFoundError as e:
+                raise CommandError(f'OCR model not found: {e}')
+            self.stdout.write(f"CRNN loaded in {time.perf_counter() - started:.1f}s")
+
+        if not options['skip_correction']:
+            started = time.perf_counter()
+            service = get_correction_service().load()
+            self.stdout.write(f"ViT5 loaded from {service.model_path} in {time.perf_counter() - started:.1f}s")
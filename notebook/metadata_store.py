@@ -0,0 +1,170 @@
+"""Concurrency-safe reads and writes of book_storage/<book>/data.json.
+
+Every write goes to a temporary file in the book folder that is fsynced and
+renamed over data.json, so readers see either the old or the new file and
+never a truncated one. Writers of the same book are serialized by a lock
+stripe (threads) and an flock on ``_locks/<book>.lock`` (processes);
+different books don't wait for each other. The lock file lives outside the
+book folder, so taking the lock never recreates a deleted book's folder.
+
+``schedule`` coalesces bursts of updates to one book (several tabs
+autosaving pages) into a single write ``METADATA_COALESCE_MS`` after the
+first one, made from the latest state. The state is built once the lock is
+held, so a write that waited for the book's deletion writes nothing.
+"""
+import atexit
+import json
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from notebook.instrumentation import timed
+
+try:
+    import fcntl
+except ImportError:  # Windows: thread locks only
+    fcntl = None
+
+LOCK_STRIPES = 64
+
+
+class MetadataStore:
+    """data.json files of the books under root.
+
+    Args:
+        root (str): Folder holding one sub-folder per book.
+        coalesce_ms (int): Delay of scheduled writes; 0 writes immediately.
+    """
+
+    def __init__(self, root, coalesce_ms=200):
+        self.root = root
+        self.coalesce_ms = coalesce_ms
+        self._locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+
+    def path(self, book_id):
+        return os.path.join(self.root, book_id, 'data.json')
+
+    @contextmanager
+    def lock(self, book_id):
+        """Exclusive access to one book's metadata across threads and processes"""
+        with self._locks[hash(book_id) % LOCK_STRIPES]:
+            if fcntl is None:
+                yield
+                return
+            locks_dir = os.path.join(self.root, '_locks')
+            os.makedirs(locks_dir, exist_ok=True)
+            with open(os.path.join(locks_dir, f'{book_id}.lock'), 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def read(self, book_id):
+        """Metadata of a book, or None if it has no data.json"""
+        try:
+            with open(self.path(book_id), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    @timed('metadata_write')
+    def _write(self, book_id, data):
+        folder = os.path.join(self.root, book_id)
+        os.makedirs(folder, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=folder, prefix='.data.json.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(data, f, indent=2, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path(book_id))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def write(self, book_id, data):
+        """Atomically replace a book's metadata"""
+        with self.lock(book_id):
+            self._write(book_id, data)
+
+    def update(self, book_id, mutate):
+        """Read-modify-write under the book's lock
+        Args:
+            mutate (callable): Gets the current metadata (None if missing) and returns the new one
+        """
+        with self.lock(book_id):
+            data = mutate(self.read(book_id))
+            self._write(book_id, data)
+            return data
+
+    def schedule(self, book_id, producer):
+        """Write producer() soon, merged with other writes of the book scheduled meanwhile
+        Args:
+            producer (callable): Returns the metadata to write, or None to write nothing;
+                called under the book's lock when the write happens
+        """
+        if not self.coalesce_ms:
+            self._produce_and_write(book_id, producer)
+            return
+        with self._pending_lock:
+            already_scheduled = book_id in self._pending
+            self._pending[book_id] = producer
+        if not already_scheduled:
+            timer = threading.Timer(self.coalesce_ms / 1000, self._flush_scheduled, args=(book_id,))
+            timer.daemon = True
+            timer.start()
+
+    def _flush_scheduled(self, book_id):
+        from django.db import connection
+
+        try:
+            self.flush(book_id)
+        finally:
+            connection.close()  # producers may query from this timer thread
+
+    def flush(self, book_id=None):
+        """Write scheduled metadata now (of one book, or of all books)"""
+        with self._pending_lock:
+            book_ids = [book_id] if book_id is not None else list(self._pending)
+            producers = [(book_id, self._pending.pop(book_id)) for book_id in book_ids if book_id in self._pending]
+        for book_id, producer in producers:
+            self._produce_and_write(book_id, producer)
+
+    def _produce_and_write(self, book_id, producer):
+        # Built under the lock: a deletion that held it meanwhile makes producer() return None
+        with self.lock(book_id):
+            try:
+                data = producer()
+            except Exception as e:
+                print(f"Error building metadata of {book_id}: {str(e)}")
+                return
+            if data is not None:
+                self._write(book_id, data)
+
+    def discard(self, book_id):
+        """Forget a scheduled write (the book is being deleted)"""
+        with self._pending_lock:
+            self._pending.pop(book_id, None)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_metadata_store():
+    """The process-wide MetadataStore of settings.BOOK_STORAGE_DIR"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = MetadataStore(settings.BOOK_STORAGE_DIR,
+                                       coalesce_ms=getattr(settings, 'METADATA_COALESCE_MS', 200))
+                atexit.register(_store.flush)
+    return _store
@@ -0,0 +1,85 @@
+# Generated by Django 4.2.22 on 2026-10-18 09:00
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def fill_ids(apps, schema_editor):
+    """Give rows created before this migration a book slug and page id"""
+    Book = apps.get_model('notebook', 'Book')
+    Page = apps.get_model('notebook', 'Page')
+    for book in Book.objects.filter(slug__isnull=True):
+        book.slug = f"book-{book.pk}"
+        book.save(update_fields=['slug'])
+    for page in Page.objects.filter(page_id=''):
+        page.page_id = str(page.pk)
+        page.position = page.pk
+        page.save(update_fields=['page_id', 'position'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notebook', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='slug',
+            field=models.CharField(max_length=200, null=True),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='last_modified',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='page',
+            name='page_id',
+            field=models.CharField(default='', max_length=64),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='page',
+            name='position',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='page',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AlterField(
+            model_name='page',
+            name='image',
+            field=models.ImageField(blank=True, upload_to='pages/'),
+        ),
+        migrations.RunPython(fill_ids, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='book',
+            name='slug',
+            field=models.CharField(max_length=200, unique=True),
+        ),
+        migrations.AlterModelOptions(
+            name='page',
+            options={'ordering': ['position', 'id']},
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['created_at'], name='notebook_bo_created_9ff52f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['last_modified'], name='notebook_bo_last_mo_0bcbf0_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='page',
+            index=models.Index(fields=['book', 'position'], name='notebook_pa_book_id_2f34be_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='page',
+            constraint=models.UniqueConstraint(fields=('book', 'page_id'), name='unique_page_per_book'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.22 on 2026-10-18 11:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notebook', '0002_book_page_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='page',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+    ]
@@ -0,0 +1,60 @@
+import json
+import os
+from datetime import datetime
+
+from django.conf import settings
+from django.db import migrations
+from django.utils import timezone
+
+
+def import_book_storage(apps, schema_editor):
+    """Create the Books and Pages of book_storage folders saved before the database held them
+
+    Same as ``manage.py import_book_storage`` for books missing from the
+    database, so the first page saved to a legacy book doesn't replace its
+    data.json with an empty one.
+    """
+    Book = apps.get_model('notebook', 'Book')
+    Page = apps.get_model('notebook', 'Page')
+    storage_dir = getattr(settings, 'BOOK_STORAGE_DIR', None)
+    if not storage_dir or not os.path.isdir(storage_dir):
+        return
+
+    def parse_date(value):
+        try:
+            return timezone.make_aware(datetime.strptime(value, "%Y-%m-%d"))
+        except (TypeError, ValueError):
+            return timezone.now()
+
+    for slug in sorted(os.listdir(storage_dir)):
+        folder_path = os.path.join(storage_dir, slug)
+        try:
+            with open(os.path.join(folder_path, 'data.json'), 'r', encoding='utf-8') as f:
+                metadata = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if not isinstance(metadata, dict) or Book.objects.filter(slug=slug).exists():
+            continue
+
+        title = metadata.get('title') or slug
+        book = Book.objects.create(slug=slug, title=title)
+        for position, page_id in enumerate(metadata.get('pages', [])):
+            image_path = os.path.join(folder_path, f"page-{page_id}.png")
+            Page.objects.update_or_create(book=book, page_id=str(page_id), defaults={
+                'position': position,
+                'image': os.path.relpath(image_path, settings.MEDIA_ROOT) if os.path.exists(image_path) else '',
+            })
+        # auto_now/auto_now_add fields ignore assigned values, so keep the original dates with update()
+        Book.objects.filter(pk=book.pk).update(created_at=parse_date(metadata.get('created_at')),
+                                               last_modified=parse_date(metadata.get('last_modified')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notebook', '0003_page_content_hash'),
+    ]
+
+    operations = [
+        migrations.RunPython(import_book_storage, migrations.RunPython.noop),
+    ]
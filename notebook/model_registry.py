@@ -0,0 +1,136 @@
+"""Process-wide registry for the CRNN OCR model.
+
+The Keras graph (or the exported TFLite artifact, see ``OCR_BACKEND``) is
+loaded once per worker process, then shared by every request handled by
+that process. When ``OCR_HOT_RELOAD`` is enabled the model file's mtime is checked on
+each lookup and a fresh model is swapped in as soon as a new checkpoint is
+rolled out, so gunicorn workers don't need a restart. One thread loads the
+new file while the others keep using the current model. If the new file can't
+be loaded (e.g. it's still being copied) the previous model keeps serving
+and that version of the file isn't tried again.
+"""
+import os
+import threading
+
+import numpy as np
+from django.conf import settings
+
+from notebook.instrumentation import stage
+
+_lock = threading.Lock()
+_model = None
+_weights_mtime = None
+_failed_mtime = None  # mtime of a checkpoint that failed to load
+
+
+def get_weights_path():
+    """Return the configured path of the CRNN checkpoint weights."""
+    return getattr(settings, 'OCR_WEIGHTS_PATH',
+                   os.path.join(settings.BASE_DIR, 'model_checkpoint_weights.hdf5'))
+
+
+def get_model_path():
+    """Return the file the configured OCR backend is loaded from."""
+    if getattr(settings, 'OCR_BACKEND', 'keras') == 'tflite':
+        return getattr(settings, 'OCR_TFLITE_PATH',
+                       os.path.join(settings.BASE_DIR, 'model_crnn.tflite'))
+    return get_weights_path()
+
+
+def load_ocr_model(weights_path=None, variable_width=False, warmup=False):
+    """Build a fresh CRNN and load the checkpoint weights into it.
+
+    Args:
+        weights_path (str): Defaults to ``get_weights_path()``.
+        variable_width (bool): Build the graph with a dynamic input width so
+            trimmed lines can be fed in; the weights are the same.
+        warmup (bool): Run a dummy 118x2167 batch through the model.
+    """
+    from notebook.RCNNMdoels import MODEL_HEIGHT, MODEL_WIDTH, build_crnn
+
+    # Every build gets its own layers, so swapping in a new checkpoint
+    # never touches a model that is still serving a request
+    model = build_crnn(None if variable_width else MODEL_WIDTH)
+    model.load_weights(weights_path or get_weights_path())
+
+    if warmup:
+        model.predict(np.zeros((1, MODEL_HEIGHT, MODEL_WIDTH, 1), dtype=np.float32), verbose=0)
+    return model
+
+
+def load_tflite_model(model_path, warmup=False):
+    """Load a converted .tflite CRNN into a TFLiteBackend."""
+    from notebook.ocr_backends import TFLiteBackend
+    from notebook.RCNNMdoels import MODEL_HEIGHT, MODEL_WIDTH
+
+    model = TFLiteBackend(model_path, num_threads=getattr(settings, 'OCR_TFLITE_THREADS', None))
+    if warmup:
+        model.predict(np.zeros((1, MODEL_HEIGHT, MODEL_WIDTH, 1), dtype=np.float32))
+    return model
+
+
+def get_ocr_model():
+    """Return the shared OCR model, loading or hot-reloading it when needed.
+
+    The returned object is a Keras model or, with ``OCR_BACKEND = 'tflite'``,
+    a TFLiteBackend; both are used through ``predict()``.
+
+    Raises:
+        FileNotFoundError: if the weights / model file does not exist.
+    """
+    global _model, _weights_mtime, _failed_mtime
+
+    weights_path = get_model_path()
+    if not os.path.exists(weights_path):
+        raise FileNotFoundError(weights_path)
+
+    hot_reload = getattr(settings, 'OCR_HOT_RELOAD', True)
+    mtime = os.path.getmtime(weights_path) if hot_reload else _weights_mtime
+
+    model = _model
+    if model is not None and mtime in (_weights_mtime, _failed_mtime):
+        return model
+
+    if model is None:
+        _lock.acquire()
+    elif not _lock.acquire(blocking=False):
+        # Another thread is reloading; keep serving the current model until it swaps the new one in
+        return model
+    try:
+        with stage('model_load'):
+            if _model is None or (hot_reload and mtime not in (_weights_mtime, _failed_mtime)):
+                try:
+                    if getattr(settings, 'OCR_BACKEND', 'keras') == 'tflite':
+                        model = load_tflite_model(weights_path, warmup=getattr(settings, 'OCR_WARMUP', True))
+                    else:
+                        model = load_ocr_model(
+                            weights_path,
+                            variable_width=getattr(settings, 'OCR_VARIABLE_WIDTH', False),
+                            warmup=getattr(settings, 'OCR_WARMUP', True),
+                        )
+                except Exception as e:
+                    if _model is None:
+                        raise
+                    _failed_mtime = mtime
+                    print(f"Reloading the OCR model from {weights_path} failed, keeping the previous one: {str(e)}")
+                    return _model
+                _model = model
+                _weights_mtime = os.path.getmtime(weights_path)
+                _failed_mtime = None
+            return _model
+    finally:
+        _lock.release()
+
+
+def get_model_version():
+    """Identify the loaded model (file name and mtime), e.g. for cache keys."""
+    return f"{os.path.basename(get_model_path())}@{_weights_mtime}"
+
+
+def reset_ocr_model():
+    """Drop the cached model so the next lookup reloads it from disk."""
+    global _model, _weights_mtime, _failed_mtime
+    with _lock:
+        _model = None
+        _weights_mtime = None
+        _failed_mtime = None
@@ -1,19 +1,53 @@
 from django.db import models
 
 class Book(models.Model):
+    # Folder name under BOOK_STORAGE_DIR, used as the book id in URLs
+    slug = models.CharField(max_length=200, unique=True)
     title = models.CharField(max_length=200)
     subject = models.CharField(max_length=100, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    last_modified = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at']),
+            models.Index(fields=['last_modified']),
+        ]
 
     def __str__(self):
         return self.title
 
+    def to_dict(self):
+        """Book metadata in the data.json format the frontend reads"""
+        return {
+            "id": self.slug,
+            "title": self.title,
+            "created_at": self.created_at.date().isoformat(),
+            "last_modified": self.last_modified.date().isoformat(),
+            "pages": [page.page_id for page in self.pages.all()],
+        }
+
 
 class Page(models.Model):
     book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='pages')
-    image = models.ImageField(upload_to='pages/')
+    # Page id chosen by the canvas; the image is book_storage/<book>/page-<page_id>.png
+    page_id = models.CharField(max_length=64)
+    position = models.PositiveIntegerField(default=0)
+    image = models.ImageField(upload_to='pages/', blank=True)
+    # SHA-256 of the uploaded image, naming its blob in book_storage/_blobs
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)
     extracted_text = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['position', 'id']
+        constraints = [
+            models.UniqueConstraint(fields=['book', 'page_id'], name='unique_page_per_book'),
+        ]
+        indexes = [
+            models.Index(fields=['book', 'position']),
+        ]
 
     def __str__(self):
-        return f"Page {self.id} of {self.book.title}"
+        return f"Page {self.page_id} of {self.book.title}"
@@ -0,0 +1,53 @@
+"""Runtime backends the CRNN can be served from.
+
+Backends expose the same ``predict(batch, batch_size=None, verbose=0)`` call
+as a Keras model, so everything that takes a ``model`` (``predict_texts``,
+``extract_text_from_arrays``...) works with either. The backend is picked
+with ``settings.OCR_BACKEND``:
+
+* ``'keras'``  - the Keras graph with ``model_checkpoint_weights.hdf5``
+* ``'tflite'`` - the frozen artifact written by ``manage.py export_crnn``
+  (BatchNormalization folded, optionally quantized), run by the TFLite
+  interpreter, which uses XNNPACK for float kernels on CPU.
+"""
+import threading
+
+import numpy as np
+
+
+class TFLiteBackend:
+    """Serve a converted .tflite CRNN with a Keras-like predict().
+
+    Args:
+        model_path (str): Path of the .tflite file.
+        num_threads (int): Interpreter threads; None lets TFLite decide.
+    """
+
+    def __init__(self, model_path, num_threads=None):
+        import tensorflow as tf
+
+        self.model_path = model_path
+        self._interpreter = tf.lite.Interpreter(model_path=model_path, num_threads=num_threads)
+        self._interpreter.allocate_tensors()
+        self._input = self._interpreter.get_input_details()[0]
+        self._output = self._interpreter.get_output_details()[0]
+        self._input_shape = tuple(self._input['shape'])
+        # The interpreter keeps per-invocation state, so calls are serialized
+        self._lock = threading.Lock()
+
+    @property
+    def input_shape(self):
+        """Input shape with dynamic dimensions as None, like Keras models."""
+        signature = self._input.get('shape_signature', self._input['shape'])
+        return tuple(None if dim < 0 else int(dim) for dim in signature)
+
+    def predict(self, batch, batch_size=None, verbose=0):
+        batch = np.ascontiguousarray(batch, dtype=np.float32)
+        with self._lock:
+            if batch.shape != self._input_shape:
+                self._interpreter.resize_tensor_input(self._input['index'], batch.shape, strict=False)
+                self._interpreter.allocate_tensors()
+                self._input_shape = batch.shape
+            self._interpreter.set_tensor(self._input['index'], batch)
+            self._interpreter.invoke()
+            return self._interpreter.get_tensor(self._output['index']).copy()
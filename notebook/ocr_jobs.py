@@ -0,0 +1,188 @@
+"""Filesystem-backed queue of OCR jobs.
+
+``extract_text_from_lines`` can enqueue a job for a ``notebook_lines``
+session instead of running the CRNN and ViT5 inside the request; a pool of
+``manage.py ocr_worker`` processes picks jobs up and stores the results,
+which clients poll from ``/api/ocr/jobs/<job_id>/``.
+
+Every job is one JSON file that moves between state folders under
+``OCR_JOBS_DIR``::
+
+    pending/ -> running/ -> done/ | failed/
+
+Workers claim a job by renaming it from ``pending`` to ``running``; the
+rename is atomic, so exactly one worker gets each job without a broker
+or a database. Jobs left in ``running`` by a worker that died are put back
+in ``pending`` after ``OCR_JOB_TIMEOUT`` seconds by the other workers, which
+check for them while polling.
+"""
+import json
+import os
+import re
+import time
+import uuid
+from datetime import datetime
+
+from django.conf import settings
+
+STATES = ('pending', 'running', 'done', 'failed')
+JOB_ID_PATTERN = re.compile(r'^\d{20}-[0-9a-f]{12}$')
+
+
+def jobs_dir():
+    return getattr(settings, 'OCR_JOBS_DIR', os.path.join(settings.BASE_DIR, 'ocr_jobs'))
+
+
+def _job_path(state, job_id):
+    return os.path.join(jobs_dir(), state, f"{job_id}.json")
+
+
+def _write_job(state, job):
+    """Write a job file atomically (temp file + rename) so readers never see half of it"""
+    folder = os.path.join(jobs_dir(), state)
+    os.makedirs(folder, exist_ok=True)
+    tmp_path = os.path.join(folder, f".{job['job_id']}.{os.getpid()}.tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(job, f, ensure_ascii=False)
+    os.replace(tmp_path, _job_path(state, job['job_id']))
+
+
+def _read_job(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def enqueue_job(session_id, timestamp, options=None):
+    """Queue OCR of a notebook_lines session
+    Args:
+        session_id (str), timestamp (str): The session folder, as returned by save-lines/
+        options (dict): Request options passed to the worker ("decoder", "beam_width",
+            and "book_id"/"page_id" of the Page to keep the text on)
+    Return:
+        The job id
+    """
+    # Ids start with the submission time so pending jobs sort oldest first
+    job_id = f"{datetime.now().strftime('%Y%m%d%H%M%S%f')}-{uuid.uuid4().hex[:12]}"
+    _write_job('pending', {
+        'job_id': job_id,
+        'status': 'pending',
+        'session_id': session_id,
+        'timestamp': timestamp,
+        'options': options or {},
+        'created_at': time.time(),
+    })
+    return job_id
+
+
+def get_job(job_id):
+    """Current record of a job (its "status" is the state folder it's in), or None"""
+    if not JOB_ID_PATTERN.match(job_id):
+        return None
+    # Check later states first: a job being moved may briefly exist in two folders
+    for state in reversed(STATES):
+        try:
+            job = _read_job(_job_path(state, job_id))
+        except (FileNotFoundError, json.JSONDecodeError):
+            continue
+        job['status'] = state
+        return job
+    return None
+
+
+def claim_job(worker=None):
+    """Move the oldest pending job to running and return it (None if the queue is empty)"""
+    pending = os.path.join(jobs_dir(), 'pending')
+    os.makedirs(os.path.join(jobs_dir(), 'running'), exist_ok=True)
+    try:
+        names = sorted(name for name in os.listdir(pending) if name.endswith('.json'))
+    except FileNotFoundError:
+        return None
+
+    for name in names:
+        job_id = name[:-len('.json')]
+        try:
+            os.rename(_job_path('pending', job_id), _job_path('running', job_id))
+        except FileNotFoundError:
+            continue  # another worker claimed it first
+        job = _read_job(_job_path('running', job_id))
+        job.update(status='running', started_at=time.time(), worker=worker)
+        _write_job('running', job)
+        return job
+    return None
+
+
+def complete_job(job, result):
+    job.update(status='done', finished_at=time.time(), result=result)
+    _write_job('done', job)
+    _remove(_job_path('running', job['job_id']))
+
+
+def fail_job(job, error):
+    job.update(status='failed', finished_at=time.time(), error=error)
+    _write_job('failed', job)
+    _remove(_job_path('running', job['job_id']))
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def requeue_stale_jobs(timeout=None):
+    """Put running jobs older than timeout seconds back in pending
+    Return:
+        Number of jobs requeued
+    """
+    timeout = timeout if timeout is not None else getattr(settings, 'OCR_JOB_TIMEOUT', 600)
+    running = os.path.join(jobs_dir(), 'running')
+    if not os.path.isdir(running):
+        return 0
+
+    requeued = 0
+    for name in os.listdir(running):
+        if not name.endswith('.json'):
+            continue
+        path = os.path.join(running, name)
+        try:
+            if time.time() - os.path.getmtime(path) < timeout:
+                continue
+            os.rename(path, os.path.join(jobs_dir(), 'pending', name))
+            requeued += 1
+        except FileNotFoundError:
+            continue
+    return requeued
+
+
+def run_job(job):
+    """Recognize and correct the job's line images
+    Return:
+        {"text": corrected text, "original_text": CRNN text, "lines": line count}
+    """
+    from notebook.model_registry import get_ocr_model
+    from notebook.NLPprocess import correct_ocr_lines
+    from notebook.ocr_service import get_request_decoder, read_line_images, recognize_lines
+    from notebook.utils import lines_folder_path, list_line_images, store_page_text
+
+    base_path = lines_folder_path(job['session_id'], job['timestamp'])
+    if not os.path.exists(base_path):
+        raise FileNotFoundError('Image folder not found')
+    image_paths = list_line_images(base_path)
+    if not image_paths:
+        raise FileNotFoundError('No line images found')
+
+    decoder, decoder_key = get_request_decoder(job.get('options') or {})
+    model = get_ocr_model()
+    line_texts = recognize_lines(read_line_images(image_paths), model, decoder, decoder_key)
+
+    extracted_lines = [line_text for line_text in line_texts if line_text.strip()]
+    text = correct_ocr_lines(extracted_lines)
+    options = job.get('options') or {}
+    if options.get('book_id') and options.get('page_id') is not None:
+        store_page_text(options['book_id'], options['page_id'], text)
+    return {
+        'text': text,
+        'original_text': ' '.join(extracted_lines),
+        'lines': len(image_paths),
+    }
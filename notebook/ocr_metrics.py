@@ -0,0 +1,26 @@
+"""Accuracy metrics for comparing OCR outputs."""
+
+
+def edit_distance(reference, hypothesis):
+    """Levenshtein distance between two strings."""
+    if len(reference) < len(hypothesis):
+        reference, hypothesis = hypothesis, reference
+
+    previous = list(range(len(hypothesis) + 1))
+    for i, ref_char in enumerate(reference, 1):
+        current = [i]
+        for j, hyp_char in enumerate(hypothesis, 1):
+            current.append(min(previous[j] + 1,
+                               current[j - 1] + 1,
+                               previous[j - 1] + (ref_char != hyp_char)))
+        previous = current
+    return previous[-1]
+
+
+def character_error_rate(references, hypotheses):
+    """Character error rate of hypotheses against references (lists of strings)."""
+    errors = sum(edit_distance(ref, hyp) for ref, hyp in zip(references, hypotheses))
+    total = sum(len(ref) for ref in references)
+    if total == 0:
+        return 0.0 if errors == 0 else 1.0
+    return errors / total
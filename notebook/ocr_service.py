@@ -0,0 +1,152 @@
+"""Line recognition shared by the OCR views, ocr_worker jobs and ocr_books.
+
+``get_request_decoder`` turns request options into a CTC decoder and
+``get_model_for_request`` loads the CRNN, or the error response explaining
+why it can't be loaded.
+``recognize_lines`` / ``iter_recognized_lines`` run encoded line images
+(PNG bytes) through the 'crnn_lines' result cache and the CRNN, and
+``recognize_arrays`` / ``iter_recognized_arrays`` run images already in
+memory (segmented pages) through the 'crnn' cache and the CRNN. Both caches
+are keyed by ``recognition_context``: the model, its input width mode and
+the decoder.
+"""
+import os
+
+import cv2
+import numpy as np
+from django.conf import settings
+from django.http import JsonResponse
+
+from notebook.alphabet import char_list
+from notebook.ctc_decoder import get_decoder, get_language_model
+from notebook.inference_queue import iter_text_from_arrays_queued
+from notebook.instrumentation import timed
+from notebook.model_registry import get_model_version, get_ocr_model
+from notebook.RCNNMdoels import WIDTH_BUCKETS, iter_text_from_arrays
+from notebook.result_cache import get_cache, make_key
+
+
+def get_request_decoder(data):
+    """CTC decoder chosen by the request ("decoder", "beam_width") or settings
+    Return:
+        (decoder, key) where key identifies the decoder in cache keys
+    Raises:
+        ValueError: beam_width isn't an integer between 1 and OCR_MAX_BEAM_WIDTH
+    """
+    name = data.get('decoder') or getattr(settings, 'OCR_CTC_DECODER', 'greedy')
+    beam_width = data.get('beam_width')
+    if beam_width is None:
+        beam_width = getattr(settings, 'OCR_BEAM_WIDTH', 10)
+    try:
+        beam_width = int(beam_width)
+    except (TypeError, ValueError):
+        raise ValueError(f"beam_width must be an integer, not {beam_width!r}")
+    max_beam_width = getattr(settings, 'OCR_MAX_BEAM_WIDTH', 50)
+    if not 1 <= beam_width <= max_beam_width:
+        raise ValueError(f"beam_width must be between 1 and {max_beam_width}")
+    lm = get_language_model(char_list) if name == 'beam' else None
+    lm_weight = getattr(settings, 'OCR_LM_WEIGHT', 0.5)
+    decoder = get_decoder(name, beam_width=beam_width, lm=lm, lm_weight=lm_weight)
+    key = name
+    if name == 'beam':
+        key = f"{name}:{beam_width}"
+        if lm is not None:
+            key += f":{settings.OCR_LM_CORPUS_PATH}:{getattr(settings, 'OCR_LM_ORDER', 3)}:{lm_weight}"
+    return decoder, key
+
+
+def get_model_for_request():
+    """Shared OCR model for a view
+    Return:
+        (model, None), or (None, JsonResponse) when it can't be loaded: 404 if the
+        model file is missing, 500 for any other load error
+    """
+    try:
+        return get_ocr_model(), None
+    except FileNotFoundError as e:
+        return None, JsonResponse({'error': f'OCR model not found. Please place {os.path.basename(str(e))} in your project root.'}, status=404)
+    except Exception as e:
+        return None, JsonResponse({'error': f'Failed to load OCR model: {str(e)}'}, status=500)
+
+
+def recognition_context(decoder_key):
+    """Identify everything besides a line image that decides its text, for result cache keys:
+    the model file and version, the graph's input width mode and the decoder
+    """
+    width_mode = 'variable' if getattr(settings, 'OCR_VARIABLE_WIDTH', False) else 'fixed'
+    return f"{get_model_version()}|{width_mode}|{decoder_key}"
+
+
+def recognize_lines(line_bytes, model, decoder, decoder_key):
+    """Recognize encoded line images (PNG bytes), in line order"""
+    texts = dict(iter_recognized_lines(line_bytes, model, decoder, decoder_key))
+    return [texts[index] for index in range(len(line_bytes))]
+
+
+def iter_recognized_lines(line_bytes, model, decoder, decoder_key):
+    """Yield (line index, text) for encoded line images as soon as each is known
+
+    Lines whose exact bytes were recognized before, by the same model and
+    decoder (see recognition_context), come from the 'crnn_lines' cache without being decoded; only the
+    others are preprocessed and batched through the CRNN.
+    """
+    cache = get_cache('crnn_lines')
+    cache_context = recognition_context(decoder_key)
+    keys = [make_key(cache_context, content) for content in line_bytes]
+
+    misses = []
+    for index, key in enumerate(keys):
+        cached = cache.get(key) if cache is not None else None
+        if cached is None:
+            misses.append(index)
+        else:
+            yield index, cached
+    if not misses:
+        return
+
+    images = (decode_line_image(line_bytes[index]) for index in misses)
+    for position, text in iter_recognized_arrays(images, model, decoder, decoder_key):
+        index = misses[position]
+        # Empty results may be unreadable images or failed batches, so they aren't kept
+        if cache is not None and text:
+            cache.set(keys[index], text)
+        yield index, text
+
+
+def recognize_arrays(images, model, decoder, decoder_key):
+    """Recognize line images decoded by opencv, in line order"""
+    texts = dict(iter_recognized_arrays(images, model, decoder, decoder_key))
+    return [texts[index] for index in range(len(images))]
+
+
+def iter_recognized_arrays(images, model, decoder, decoder_key):
+    """Yield (line index, text) for line images decoded by opencv as soon as each is known
+
+    Lines are batched through the CRNN, or through the shared inference
+    queue when OCR_DYNAMIC_BATCHING is on; iter_text_from_arrays looks each
+    preprocessed line up in the 'crnn' cache first.
+    """
+    if getattr(settings, 'OCR_DYNAMIC_BATCHING', False):
+        # Share forward passes with other requests running concurrently
+        return iter_text_from_arrays_queued(images, decoder=decoder)
+    batch_size = getattr(settings, 'OCR_BATCH_SIZE', 16)
+    buckets = WIDTH_BUCKETS if getattr(settings, 'OCR_VARIABLE_WIDTH', False) else None
+    return iter_text_from_arrays(images, model, char_list,
+                                 batch_size=batch_size, buckets=buckets, decoder=decoder,
+                                 cache=get_cache('crnn'),
+                                 cache_context=recognition_context(decoder_key))
+
+
+@timed('image_decode')
+def decode_line_image(content):
+    return cv2.imdecode(np.frombuffer(content, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+
+@timed('read_images')
+def read_line_images(image_paths):
+    """Bytes of line image files"""
+    contents = []
+    for image_path in image_paths:
+        with open(image_path, 'rb') as f:
+            contents.append(f.read())
+    return contents
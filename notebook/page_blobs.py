@@ -0,0 +1,97 @@
+"""Content-addressed storage of page images.
+
+Each distinct page image is stored once as ``book_storage/_blobs/<ab>/<hash>``,
+where hash is the SHA-256 of the image bytes the canvas uploaded, and
+``book_storage/<book>/page-<id>.png`` is a hard link to it, so the URLs the
+canvas loads don't change while identical pages (blank pages, copies) share
+their bytes. Where hard links aren't supported the blob is copied instead.
+
+``PAGE_IMAGE_FORMAT`` re-encodes blobs when they are first stored:
+'png' keeps the upload as is, 'optimized-png' recompresses it at the highest
+zlib level and 'webp' stores lossless WebP (still served as page-<id>.png;
+browsers sniff the image type).
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+
+
+def content_hash(content):
+    return hashlib.sha256(content).hexdigest()
+
+
+def blob_path(digest):
+    return os.path.join(settings.BOOK_STORAGE_DIR, '_blobs', digest[:2], digest)
+
+
+def encode_image(content, image_format=None):
+    """Re-encode uploaded PNG bytes in the configured format (the upload itself on failure)"""
+    image_format = image_format or getattr(settings, 'PAGE_IMAGE_FORMAT', 'png')
+    if image_format == 'png':
+        return content
+
+    import cv2
+    import numpy as np
+
+    image = cv2.imdecode(np.frombuffer(content, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+    if image is None:
+        return content
+    if image_format == 'optimized-png':
+        ok, encoded = cv2.imencode('.png', image, [cv2.IMWRITE_PNG_COMPRESSION, 9])
+    elif image_format == 'webp':
+        # Quality above 100 selects lossless WebP
+        ok, encoded = cv2.imencode('.webp', image, [cv2.IMWRITE_WEBP_QUALITY, 101])
+    else:
+        raise ValueError(f"Unknown PAGE_IMAGE_FORMAT: {image_format}")
+    # Keep the upload when re-encoding doesn't make it smaller
+    return encoded.tobytes() if ok and len(encoded) < len(content) else content
+
+
+def _atomic_write(path, content):
+    folder = os.path.dirname(path)
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=folder, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def store_blob(content):
+    """Store image bytes once
+    Return:
+        The content hash naming the blob
+    """
+    digest = content_hash(content)
+    path = blob_path(digest)
+    if not os.path.exists(path):
+        _atomic_write(path, encode_image(content))
+    return digest
+
+
+def link_blob(digest, target_path):
+    """Point target_path at a blob (hard link, or a copy where links aren't possible)"""
+    folder = os.path.dirname(target_path)
+    os.makedirs(folder, exist_ok=True)
+    tmp_path = os.path.join(folder, f".{os.path.basename(target_path)}.{os.getpid()}.tmp")
+    try:
+        os.link(blob_path(digest), tmp_path)
+    except OSError:
+        shutil.copyfile(blob_path(digest), tmp_path)
+    # Replace rather than overwrite: other pages linked to the old blob keep their bytes
+    os.replace(tmp_path, target_path)
+
+
+def remove_unused_blobs(digests):
+    """Delete blobs no Page refers to anymore"""
+    from notebook.models import Page
+
+    digests = {digest for digest in digests if digest}
+    used = set(Page.objects.filter(content_hash__in=digests).values_list('content_hash', flat=True))
+    for digest in digests - used:
+        try:
+            os.remove(blob_path(digest))
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,262 @@
+"""Result caches for OCR and correction.
+
+A bounded in-memory LRU, optionally backed by a persistent SQLite table so
+results survive restarts and are shared between worker processes. Keys are
+hashes of the normalized input plus the model version, so rolling a new
+checkpoint never serves stale results.
+
+Used in front of ``correct_ocr`` (keyed by normalized OCR text) and of CRNN
+recognition, both by the uploaded line image bytes ('crnn_lines', so
+unchanged lines skip decoding and preprocessing too) and by the preprocessed
+line image ('crnn', which also catches re-encoded but identical lines). The
+on-disk tables are bounded by entries and by bytes, checked every 64 writes,
+evicting least recently used rows first; the last-used times of hits are
+written in batches too, so reads don't write to the file.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+def normalize_text(text):
+    """NFC-normalize and collapse whitespace so trivially different inputs share a key"""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def make_key(*parts):
+    """Hash str/bytes parts into a cache key"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else str(part).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class LRUCache:
+    """Thread-safe in-memory LRU of string values with hit/miss/eviction counters."""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._data), 'max_entries': self.max_entries,
+                    'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'hit_rate': hit_rate(self.hits, self.misses)}
+
+
+def hit_rate(hits, misses):
+    return round(hits / (hits + misses), 4) if hits + misses else None
+
+
+class SQLiteCache:
+    """Persistent key/value table in a SQLite file, evicting least recently used rows.
+
+    Args:
+        path (str): SQLite database file (shared by all caches and processes).
+        table (str): Table holding this cache's rows.
+        max_entries (int): Rows kept before the least recently used are evicted
+            (checked every EVICT_CHECK_EVERY sets, so briefly exceeded).
+        max_bytes (int): Total size of keys and values kept; None for no limit.
+    """
+
+    # Sets between checks of the table's row count and total size
+    EVICT_CHECK_EVERY = 64
+    # Hits whose last_used update is batched into one write
+    TOUCH_FLUSH_EVERY = 64
+
+    def __init__(self, path, table, max_entries=100000, max_bytes=None):
+        self.path = path
+        self.table = table
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._sets = 0
+        self._touched = {}  # key -> last_used of hits not written yet
+        self.hits = self.misses = self.evictions = self.errors = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(f"CREATE TABLE IF NOT EXISTS {table} "
+                           "(key TEXT PRIMARY KEY, value TEXT NOT NULL, last_used REAL NOT NULL, "
+                           "size INTEGER NOT NULL DEFAULT 0)")
+        columns = [row[1] for row in self._conn.execute(f"PRAGMA table_info({table})")]
+        if 'size' not in columns:
+            # Tables created before the byte limit existed
+            self._conn.execute(f"ALTER TABLE {table} ADD COLUMN size INTEGER NOT NULL DEFAULT 0")
+            self._conn.execute(f"UPDATE {table} SET size = length(key) + length(CAST(value AS BLOB))")
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_last_used ON {table} (last_used)")
+        self._conn.commit()
+
+    # The file is shared by every worker process, so it can be locked or
+    # otherwise fail; the cache then behaves as a miss / a no-op.
+
+    def get(self, key):
+        with self._lock:
+            try:
+                row = self._conn.execute(f"SELECT value FROM {self.table} WHERE key = ?", (key,)).fetchone()
+            except sqlite3.Error as e:
+                self._failed('read', e)
+                return None
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._touched[key] = time.time()
+            if len(self._touched) >= self.TOUCH_FLUSH_EVERY:
+                try:
+                    self._flush_touched()
+                    self._conn.commit()
+                except sqlite3.Error as e:
+                    self._failed('update', e)
+            return row[0]
+
+    def set(self, key, value):
+        with self._lock:
+            size = len(key) + len(value.encode('utf-8'))
+            try:
+                self._conn.execute(f"INSERT OR REPLACE INTO {self.table} (key, value, last_used, size) "
+                                   "VALUES (?, ?, ?, ?)", (key, value, time.time(), size))
+                self._sets += 1
+                if self._sets % self.EVICT_CHECK_EVERY == 0:
+                    self._flush_touched()
+                    self._evict_entries()
+                    if self.max_bytes:
+                        self._evict_bytes()
+                self._conn.commit()
+            except sqlite3.Error as e:
+                self._failed('write', e)
+
+    def _failed(self, operation, error):
+        self.errors += 1
+        try:
+            self._conn.rollback()
+        except sqlite3.Error:
+            pass
+        print(f"Result cache {self.table}: {operation} failed: {str(error)}")
+
+    def _flush_touched(self):
+        # Write the last_used times of recent hits, which decide what gets evicted
+        touched = [(used, key) for key, used in self._touched.items()]
+        self._touched.clear()
+        self._conn.executemany(f"UPDATE {self.table} SET last_used = ? WHERE key = ?", touched)
+
+    def _evict_entries(self):
+        count = self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+        if count > self.max_entries:
+            self.evictions += self._conn.execute(
+                f"DELETE FROM {self.table} WHERE key IN "
+                f"(SELECT key FROM {self.table} ORDER BY last_used LIMIT ?)",
+                (count - self.max_entries,)).rowcount
+
+    def _evict_bytes(self):
+        # Drop least recently used rows until the table is back under max_bytes
+        excess = self._total_bytes() - self.max_bytes
+        if excess <= 0:
+            return
+        rows = self._conn.execute(f"SELECT key, size FROM {self.table} ORDER BY last_used")
+        keys = []
+        for key, size in rows:
+            if excess <= 0:
+                break
+            keys.append((key,))
+            excess -= size
+        rows.close()
+        self._conn.executemany(f"DELETE FROM {self.table} WHERE key = ?", keys)
+        self.evictions += len(keys)
+
+    def _total_bytes(self):
+        return self._conn.execute(f"SELECT COALESCE(SUM(size), 0) FROM {self.table}").fetchone()[0]
+
+    def stats(self):
+        with self._lock:
+            try:
+                entries = self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+                total_bytes = self._total_bytes()
+            except sqlite3.Error:
+                entries = total_bytes = None
+            return {'entries': entries, 'max_entries': self.max_entries,
+                    'bytes': total_bytes, 'max_bytes': self.max_bytes,
+                    'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'errors': self.errors, 'hit_rate': hit_rate(self.hits, self.misses)}
+
+
+class TieredCache:
+    """In-memory LRU in front of an optional persistent cache."""
+
+    def __init__(self, memory, disk=None):
+        self.memory = memory
+        self.disk = disk
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is None and self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                self.memory.set(key, value)
+        return value
+
+    def set(self, key, value):
+        self.memory.set(key, value)
+        if self.disk is not None:
+            self.disk.set(key, value)
+
+    def stats(self):
+        stats = {'memory': self.memory.stats()}
+        if self.disk is not None:
+            stats['disk'] = self.disk.stats()
+        return stats
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(name):
+    """Return the process-wide cache called name ('correction', 'crnn', 'crnn_lines'),
+    or None when OCR_CACHE_ENABLED is off."""
+    if not getattr(settings, 'OCR_CACHE_ENABLED', True):
+        return None
+    if name not in _caches:
+        with _caches_lock:
+            if name not in _caches:
+                path = getattr(settings, 'OCR_CACHE_PATH', None)
+                max_mb = getattr(settings, 'OCR_CACHE_DISK_MAX_MB', None)
+                disk = SQLiteCache(path, f"{name}_cache",
+                                   max_entries=getattr(settings, 'OCR_CACHE_DISK_ENTRIES', 100000),
+                                   max_bytes=int(max_mb * 1024 * 1024) if max_mb else None) if path else None
+                memory = LRUCache(getattr(settings, 'OCR_CACHE_MEMORY_ENTRIES', 10000))
+                _caches[name] = TieredCache(memory, disk)
+    return _caches[name]
+
+
+def cache_stats():
+    """Stats of every cache created in this process"""
+    return {name: cache.stats() for name, cache in _caches.items()}
@@ -0,0 +1,175 @@
+"""Full-text search over the OCR text of pages.
+
+Page texts are indexed in an SQLite FTS5 table (``SEARCH_INDEX_PATH``) in
+folded form: lower case with Vietnamese diacritics removed and đ read as d,
+for the CRNN alphabet and any other letters in corrected text, so "tieng
+viet" finds "Tiếng Việt". Folding maps each character to exactly one
+character, so match positions in the folded text are also positions in the
+original text and snippets highlight the original words. Results are ranked by BM25.
+
+The index is kept up to date by ``store_page_text`` and page/book deletion;
+``manage.py rebuild_search_index`` rebuilds it from ``Page.extracted_text``.
+"""
+import html
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+
+from django.conf import settings
+
+from notebook.alphabet import char_list
+from notebook.instrumentation import timed
+
+
+def _fold_char(char):
+    if char in 'đĐ':
+        return 'd'
+    base = ''.join(c for c in unicodedata.normalize('NFD', char) if not unicodedata.combining(c)).lower()
+    return base if len(base) == 1 else char
+
+
+class _FoldTable(dict):
+    # str.translate table: the CRNN alphabet up front, other characters
+    # (from corrected text) folded the same way on first sight
+    def __missing__(self, code):
+        self[code] = _fold_char(chr(code))
+        return self[code]
+
+
+FOLD_TABLE = _FoldTable({ord(char): _fold_char(char) for char in char_list})
+
+
+def fold(text):
+    """Lower-case text and strip its diacritics, keeping its length"""
+    return unicodedata.normalize('NFC', text).translate(FOLD_TABLE)
+
+
+def query_terms(query):
+    return re.findall(r'\w+', fold(query))
+
+
+def snippet(text, terms, width=160):
+    """HTML excerpt of text around the first match, matches wrapped in <mark>"""
+    text = unicodedata.normalize('NFC', text)
+    folded = fold(text)
+    pattern = re.compile(r'\b(?:' + '|'.join(re.escape(term) for term in terms) + r')\w*')
+    matches = list(pattern.finditer(folded))
+
+    first = matches[0].start() if matches else 0
+    start = max(0, first - width // 3)
+    end = min(len(text), start + width)
+    if start > 0 and ' ' in text[start:first]:
+        start = text.index(' ', start) + 1  # don't cut the first word
+
+    parts, position = [], start
+    for match in matches:
+        if match.end() <= start or match.start() >= end:
+            continue
+        match_start, match_end = max(match.start(), start), min(match.end(), end)
+        parts.append(html.escape(text[position:match_start]))
+        parts.append(f"<mark>{html.escape(text[match_start:match_end])}</mark>")
+        position = match_end
+    parts.append(html.escape(text[position:end]))
+    return ('…' if start > 0 else '') + ''.join(parts) + ('…' if end < len(text) else '')
+
+
+class SearchIndex:
+    """FTS5 index of page texts in an SQLite file.
+
+    Args:
+        path (str): SQLite database file of the index.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS pages "
+                           "(id INTEGER PRIMARY KEY, book TEXT NOT NULL, page_id TEXT NOT NULL, "
+                           "text TEXT NOT NULL, UNIQUE (book, page_id))")
+        self._conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS pages_fts USING fts5"
+                           "(folded, tokenize = 'unicode61 remove_diacritics 0')")
+        self._conn.commit()
+
+    @timed('search_index')
+    def add(self, book, page_id, text):
+        """Index (or reindex) a page's text; empty text removes the page"""
+        if not text.strip():
+            self.remove(book, page_id)
+            return
+        with self._lock:
+            row = self._conn.execute("SELECT id FROM pages WHERE book = ? AND page_id = ?",
+                                     (book, page_id)).fetchone()
+            if row is None:
+                rowid = self._conn.execute("INSERT INTO pages (book, page_id, text) VALUES (?, ?, ?)",
+                                           (book, page_id, text)).lastrowid
+            else:
+                rowid = row[0]
+                self._conn.execute("UPDATE pages SET text = ? WHERE id = ?", (text, rowid))
+                self._conn.execute("DELETE FROM pages_fts WHERE rowid = ?", (rowid,))
+            self._conn.execute("INSERT INTO pages_fts (rowid, folded) VALUES (?, ?)", (rowid, fold(text)))
+            self._conn.commit()
+
+    def remove(self, book, page_id=None):
+        """Remove one page, or every page of a book when page_id is None"""
+        with self._lock:
+            if page_id is None:
+                rows = self._conn.execute("SELECT id FROM pages WHERE book = ?", (book,)).fetchall()
+            else:
+                rows = self._conn.execute("SELECT id FROM pages WHERE book = ? AND page_id = ?",
+                                          (book, page_id)).fetchall()
+            self._conn.executemany("DELETE FROM pages_fts WHERE rowid = ?", rows)
+            self._conn.executemany("DELETE FROM pages WHERE id = ?", rows)
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM pages_fts")
+            self._conn.execute("DELETE FROM pages")
+            self._conn.commit()
+
+    @timed('search_query')
+    def search(self, query, book=None, offset=0, limit=20):
+        """Pages matching every word of query (as a word prefix), best first
+        Return:
+            (total matches, [{"book", "page_id", "score", "snippet"}])
+        """
+        terms = query_terms(query)
+        if not terms:
+            return 0, []
+        match = ' '.join(f'"{term}"*' for term in terms)
+        where, params = "pages_fts MATCH ?", [match]
+        if book is not None:
+            where += " AND pages.book = ?"
+            params.append(book)
+
+        with self._lock:
+            total = self._conn.execute(
+                f"SELECT COUNT(*) FROM pages_fts JOIN pages ON pages.id = pages_fts.rowid WHERE {where}",
+                params).fetchone()[0]
+            rows = self._conn.execute(
+                f"SELECT pages.book, pages.page_id, pages.text, bm25(pages_fts) AS rank "
+                f"FROM pages_fts JOIN pages ON pages.id = pages_fts.rowid WHERE {where} "
+                f"ORDER BY rank LIMIT ? OFFSET ?", params + [limit, offset]).fetchall()
+
+        return total, [{'book': book_id, 'page_id': page_id, 'score': round(-rank, 4),
+                        'snippet': snippet(text, terms)} for book_id, page_id, text, rank in rows]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_search_index():
+    """The process-wide SearchIndex at settings.SEARCH_INDEX_PATH"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = SearchIndex(getattr(settings, 'SEARCH_INDEX_PATH',
+                                             os.path.join(settings.BASE_DIR, 'search_index.sqlite3')))
+    return _index
@@ -0,0 +1,96 @@
+"""Split a full page image into line images for the CRNN.
+
+Pages saved by the canvas are white with light ruled lines (#ddd every
+90px) under the handwriting. ``segment_page`` finds the ink, drops the
+ruled lines and specks, and cuts the page where the horizontal projection
+profile of the ink is empty, so lines written across a ruled line or with
+uneven spacing still come out whole. Each crop is the ink alone on white,
+like the lines the canvas uploads, so it can go straight to
+``recognize_arrays``.
+
+``split_ruled_lines`` is the canvas' own fixed-spacing split, for comparison.
+"""
+import cv2
+import numpy as np
+
+RULED_LINE_SPACING = 90
+
+
+def to_bgr(image):
+    """BGR copy of a gray, BGR or BGRA image (transparent pixels become white)"""
+    if image.ndim == 2:
+        return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    if image.shape[2] == 4:
+        alpha = image[:, :, 3:].astype(np.float32) / 255
+        return (image[:, :, :3] * alpha + 255 * (1 - alpha)).astype(np.uint8)
+    return image
+
+
+def ink_mask(image, ink_threshold=160, min_component_area=8):
+    """Boolean mask of handwriting pixels
+    Args:
+        image (numpy.array): BGR page image
+        ink_threshold (int): Gray level below which a pixel is ink (ruled lines are 221)
+        min_component_area (int): Connected components smaller than this are noise
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    mask = (gray < ink_threshold).astype(np.uint8)
+
+    # Remove dark ruled lines: runs of ink spanning most of the page width
+    width = image.shape[1]
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (max(width // 2, 1), 1))
+    mask &= 1 - cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
+
+    count, labels, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    keep = stats[:, cv2.CC_STAT_AREA] >= min_component_area
+    keep[0] = False  # background
+    return keep[labels]
+
+
+def line_bands(mask, min_gap=6, min_height=12, min_ink=2):
+    """Row ranges holding a line of text
+    Args:
+        mask (numpy.array): Ink mask of the page
+        min_gap (int): Blank rows needed to separate two lines
+        min_height (int): Bands shorter than this are dropped
+        min_ink (int): Ink pixels a row needs to count as written
+    Return:
+        List of (top, bottom) row ranges, bottom exclusive
+    """
+    written = mask.sum(axis=1) >= min_ink
+    # Starts and ends of runs of written rows
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], written.astype(np.int8), [0]))))
+    runs = edges.reshape(-1, 2)
+
+    bands = []
+    for top, bottom in runs:
+        if bands and top - bands[-1][1] < min_gap:
+            bands[-1][1] = bottom
+        else:
+            bands.append([top, bottom])
+    return [(int(top), int(bottom)) for top, bottom in bands if bottom - top >= min_height]
+
+
+def segment_page(image, margin=8, **options):
+    """Line images of a page, top to bottom
+    Args:
+        image (numpy.array): Page image (gray, BGR or BGRA)
+        margin (int): Rows of padding kept above and below each line
+        options: ink_threshold / min_component_area for ink_mask,
+            min_gap / min_height / min_ink for line_bands
+    Return:
+        List of BGR line images, ink on white
+    """
+    image = to_bgr(image)
+    mask = ink_mask(image, **{k: v for k, v in options.items() if k in ('ink_threshold', 'min_component_area')})
+    bands = line_bands(mask, **{k: v for k, v in options.items() if k in ('min_gap', 'min_height', 'min_ink')})
+
+    clean = np.where(mask[:, :, None], image, 255).astype(np.uint8)
+    height = image.shape[0]
+    return [clean[max(top - margin, 0):min(bottom + margin, height)] for top, bottom in bands]
+
+
+def split_ruled_lines(image, line_spacing=RULED_LINE_SPACING):
+    """Fixed-height strips, the way the canvas splits a page before OCR"""
+    return [image[i * line_spacing:(i + 1) * line_spacing] for i in range(image.shape[0] // line_spacing)]
+
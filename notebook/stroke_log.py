@@ -0,0 +1,179 @@
+"""Incremental page saves as logs of pen strokes.
+
+Instead of re-uploading the whole page after every stroke, the canvas sends
+the stroke itself (tool, color, size and points in page pixels). Strokes are
+appended to ``book_storage/<book>/page-<id>.strokes.jsonl`` and compacted
+into the page image, drawn with OpenCV, once ``PAGE_STROKE_COMPACT_EVERY``
+have accumulated and before the book is loaded, so page-<id>.png is always
+current when the canvas reads it.
+
+Appends, compactions, full saves and deletions of a page are serialized by
+a lock of their own (a thread lock stripe per page and an flock on
+``_locks/<book>.strokes.lock``), not by the book's metadata lock:
+compaction saves the page image, which writes data.json under that lock.
+Like the metadata locks, the lock file lives outside the book folder, so
+taking it neither needs nor creates the folder, and there is one per book
+whatever page ids are requested.
+
+Only pen strokes are logged; eraser strokes and undo change pixels that
+aren't described by a stroke, so the canvas saves the full page for those.
+"""
+import glob
+import json
+import os
+import re
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from notebook.instrumentation import timed
+from notebook.metadata_store import LOCK_STRIPES
+
+try:
+    import fcntl
+except ImportError:  # Windows: thread locks only
+    fcntl = None
+
+COLOR_PATTERN = re.compile(r'^#[0-9a-fA-F]{6}$')
+MAX_STROKE_SIZE = 100
+
+_locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+
+
+def log_path(book_id, page_id):
+    return os.path.join(settings.BOOK_STORAGE_DIR, book_id, f"page-{page_id}.strokes.jsonl")
+
+
+@contextmanager
+def page_lock(book_id, page_id):
+    """Exclusive access to one page's stroke log across threads and processes"""
+    with _locks[hash((book_id, str(page_id))) % LOCK_STRIPES]:
+        if fcntl is None:
+            yield
+            return
+        # One file per book: pages of a book wait for each other across processes, but not within one
+        locks_dir = os.path.join(settings.BOOK_STORAGE_DIR, '_locks')
+        os.makedirs(locks_dir, exist_ok=True)
+        with open(os.path.join(locks_dir, f'{book_id}.strokes.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def validate_stroke(stroke):
+    """Check a stroke sent by the canvas, returning it in the logged form"""
+    if not isinstance(stroke, dict) or stroke.get('tool') != 'pen':
+        raise ValueError('Only pen strokes can be saved incrementally')
+    color = stroke.get('color', '#000000')
+    if not COLOR_PATTERN.match(str(color)):
+        raise ValueError(f'Invalid stroke color: {color}')
+    size = int(stroke.get('size', 1))
+    if not 1 <= size <= MAX_STROKE_SIZE:
+        raise ValueError(f'Invalid stroke size: {size}')
+    points = stroke.get('points')
+    if not isinstance(points, list) or not points:
+        raise ValueError('A stroke needs at least one point')
+    return {'tool': 'pen', 'color': color, 'size': size,
+            'points': [[float(x), float(y)] for x, y in points]}
+
+
+@timed('stroke_append')
+def append_strokes(book, page_id, strokes):
+    """Log strokes of a page, compacting the log when it's long enough
+    Return:
+        (strokes still in the log, whether the page image was rewritten)
+    """
+    strokes = [validate_stroke(stroke) for stroke in strokes]
+    with page_lock(book.slug, page_id):
+        with open(log_path(book.slug, page_id), 'a', encoding='utf-8') as f:
+            for stroke in strokes:
+                f.write(json.dumps(stroke) + '\n')
+        pending = len(read_strokes(book.slug, page_id))
+        if pending >= getattr(settings, 'PAGE_STROKE_COMPACT_EVERY', 50):
+            _compact(book, page_id)
+            return 0, True
+    return pending, False
+
+
+def read_strokes(book_id, page_id):
+    path = log_path(book_id, page_id)
+    if not os.path.exists(path):
+        return []
+    strokes = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                strokes.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue  # a write cut short by a crash
+    return strokes
+
+
+def discard_strokes(book_id, page_id):
+    """Drop a page's log (a full snapshot of the page replaced it); call under page_lock"""
+    try:
+        os.remove(log_path(book_id, page_id))
+    except FileNotFoundError:
+        pass
+
+
+def render_strokes(image, strokes):
+    """Draw strokes onto a BGR or BGRA page image in place"""
+    import cv2
+    import numpy as np
+
+    for stroke in strokes:
+        red, green, blue = (int(stroke['color'][i:i + 2], 16) for i in (1, 3, 5))
+        color = (blue, green, red, 255)[:image.shape[2]]
+        points = np.round(np.array(stroke['points'], dtype=np.float32)).astype(np.int32)
+        cv2.polylines(image, [points.reshape(-1, 1, 2)], False, color,
+                      thickness=stroke['size'], lineType=cv2.LINE_AA)
+    return image
+
+
+def _compact(book, page_id):
+    import cv2
+
+    from notebook.utils import save_page_image
+
+    strokes = read_strokes(book.slug, page_id)
+    if not strokes:
+        return False
+    image_path = os.path.join(settings.BOOK_STORAGE_DIR, book.slug, f"page-{page_id}.png")
+    image = cv2.imread(image_path, cv2.IMREAD_UNCHANGED)
+    if image is None:
+        raise FileNotFoundError(f"Page image not found: page-{page_id}.png")
+    if image.ndim == 2:
+        image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+
+    ok, encoded = cv2.imencode('.png', render_strokes(image, strokes))
+    if not ok:
+        raise ValueError(f"Could not encode page-{page_id}.png")
+    save_page_image(book, page_id, encoded.tobytes())
+    discard_strokes(book.slug, page_id)
+    return True
+
+
+@timed('stroke_compact')
+def compact_page(book, page_id):
+    """Apply a page's logged strokes to its image and clear the log
+    Return:
+        Whether there was anything to apply
+    """
+    with page_lock(book.slug, page_id):
+        return _compact(book, page_id)
+
+
+def compact_book(book):
+    """Compact every page of a book that has logged strokes"""
+    compacted = 0
+    for path in glob.glob(log_path(book.slug, '*')):
+        page_id = os.path.basename(path)[len('page-'):-len('.strokes.jsonl')]
+        try:
+            compacted += compact_page(book, page_id)
+        except Exception as e:
+            print(f"Error compacting strokes of {book.slug}/page-{page_id}: {str(e)}")
+    return compacted
@@ -1,3 +1,312 @@
-from django.test import TestCase
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest import mock
 
-# Create your tests here.
+import cv2
+import numpy as np
+from django.db import connection
+from django.test import Client, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+
+from notebook import metadata_store, model_registry, search_index
+from notebook.ctc_decoder import beam_search_decode, greedy_decode
+from notebook.models import Book, Page
+from notebook.ocr_service import get_request_decoder, recognition_context
+from notebook.search_index import fold, snippet
+from notebook.utils import new_lines_folder, save_book, save_page_image, split_png_stream
+
+
+def blank_page_png(width=200, height=180):
+    _, encoded = cv2.imencode('.png', np.full((height, width, 3), 255, dtype=np.uint8))
+    return encoded.tobytes()
+
+
+def use_temp_storage(test, **settings):
+    """Point MEDIA_ROOT, BOOK_STORAGE_DIR and the search index at a temporary folder for one test"""
+    test.storage_dir = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, test.storage_dir, ignore_errors=True)
+    overrides = override_settings(MEDIA_ROOT=test.storage_dir, BOOK_STORAGE_DIR=test.storage_dir,
+                                  SEARCH_INDEX_PATH=os.path.join(test.storage_dir, '_search.sqlite3'), **settings)
+    overrides.enable()
+    test.addCleanup(overrides.disable)
+    # The store and index are per process; make them with the overridden settings
+    metadata_store._store = None
+    test.addCleanup(setattr, metadata_store, '_store', None)
+    search_index._index = None
+    test.addCleanup(setattr, search_index, '_index', None)
+    # Write anything still scheduled while the test's database and folder exist
+    test.addCleanup(lambda: metadata_store._store and metadata_store._store.flush())
+
+
+class StrokeLogTests(TransactionTestCase):
+    # The request runs in another thread, which must see the committed book
+    def setUp(self):
+        use_temp_storage(self, METADATA_COALESCE_MS=0, PAGE_STROKE_COMPACT_EVERY=1)
+
+    def test_compacting_strokes_with_immediate_metadata_writes(self):
+        book = Book.objects.create(slug='strokes', title='strokes')
+        save_page_image(book, '1', blank_page_png())
+        stroke = {'tool': 'pen', 'color': '#000000', 'size': 3, 'points': [[10, 10], [120, 40]]}
+
+        responses = []
+        request = threading.Thread(target=lambda: responses.append(self.client.post(
+            '/api/book/strokes/page/1/strokes/', json.dumps({'strokes': [stroke]}),
+            content_type='application/json')), daemon=True)
+        request.start()
+        request.join(timeout=10)
+
+        self.assertFalse(request.is_alive(), 'saving strokes deadlocked')
+        self.assertEqual(responses[0].status_code, 200)
+        self.assertTrue(responses[0].json()['compacted'])
+
+    def test_page_locks_leave_the_book_folder_alone(self):
+        # A new book has no folder until its data.json is written
+        Book.objects.create(slug='fresh', title='fresh')
+        for page_id in ('1', 'does-not-exist'):
+            response = self.client.post(f'/api/book/fresh/page/{page_id}/ocr/')
+            self.assertEqual(response.status_code, 404)
+        self.assertFalse(os.path.exists(os.path.join(self.storage_dir, 'fresh')))
+
+
+class SavePageTests(TestCase):
+    def setUp(self):
+        use_temp_storage(self, METADATA_COALESCE_MS=0)
+
+    def test_saving_to_a_legacy_book_keeps_its_pages(self):
+        folder = os.path.join(self.storage_dir, 'legacy')
+        os.makedirs(folder)
+        with open(os.path.join(folder, 'data.json'), 'w', encoding='utf-8') as f:
+            json.dump({'id': 'legacy', 'title': 'Legacy', 'created_at': '2025-01-02',
+                       'last_modified': '2025-01-03', 'pages': ['4', '5', '6']}, f)
+
+        response = self.client.post('/api/book/legacy/save-page/?page_id=9', blank_page_png(), content_type='image/png')
+
+        self.assertEqual(response.status_code, 200)
+        with open(os.path.join(folder, 'data.json'), encoding='utf-8') as f:
+            metadata = json.load(f)
+        self.assertEqual(metadata['pages'], ['4', '5', '6', '9'])
+        self.assertEqual(metadata['created_at'], '2025-01-02')
+        self.assertEqual(metadata['title'], 'Legacy')
+
+
+class ConcurrentSavePageTests(TransactionTestCase):
+    def setUp(self):
+        use_temp_storage(self)
+
+    def test_concurrent_saves_of_one_book(self):
+        Book.objects.create(slug='tabs', title='tabs')
+        statuses = []
+
+        def save(page_id, width):
+            response = Client().post(f'/api/book/tabs/save-page/?page_id={page_id}',
+                                     blank_page_png(width=width), content_type='image/png')
+            statuses.append(response.status_code)
+            connection.close()
+
+        requests = [threading.Thread(target=save, args=(index % 4 + 1, 100 + index)) for index in range(16)]
+        for request in requests:
+            request.start()
+        for request in requests:
+            request.join(timeout=30)
+
+        self.assertEqual(statuses, [200] * 16)
+        pages = Page.objects.filter(book__slug='tabs')
+        self.assertEqual(sorted(pages.values_list('page_id', flat=True)), ['1', '2', '3', '4'])
+        self.assertEqual(sorted(pages.values_list('position', flat=True)), [0, 1, 2, 3])
+
+
+class MetadataStoreTests(TransactionTestCase):
+    def setUp(self):
+        # Scheduled writes wait for an explicit flush
+        use_temp_storage(self, METADATA_COALESCE_MS=60000)
+        self.store = metadata_store.get_metadata_store()
+
+    def read_folder(self, book_id):
+        return sorted(os.listdir(os.path.join(self.storage_dir, book_id)))
+
+    def test_a_failed_write_keeps_the_previous_file(self):
+        self.store.write('atomic', {'title': 'first'})
+        with self.assertRaises(TypeError):
+            self.store.write('atomic', {'title': object()})
+        self.assertEqual(self.store.read('atomic'), {'title': 'first'})
+        self.assertEqual(self.read_folder('atomic'), ['data.json'])
+
+    def test_concurrent_schedules_make_one_write(self):
+        produced = []
+
+        def schedule(index):
+            self.store.schedule('burst', lambda: produced.append(index) or {'version': index})
+
+        writers = [threading.Thread(target=schedule, args=(index,)) for index in range(16)]
+        for writer in writers:
+            writer.start()
+        for writer in writers:
+            writer.join(10)
+        with mock.patch.object(self.store, '_write', wraps=self.store._write) as write:
+            self.store.flush()
+
+        self.assertEqual(write.call_count, 1)
+        self.assertEqual(len(produced), 1)
+        self.assertEqual(self.store.read('burst'), {'version': produced[0]})
+        self.assertEqual(self.read_folder('burst'), ['data.json'])
+
+    def test_deleting_a_book_drops_its_scheduled_write(self):
+        self.client.post('/create-book/', json.dumps({'title': 'gone'}), content_type='application/json')
+        self.client.post('/api/book/gone/save-page/?page_id=1', blank_page_png(), content_type='image/png')
+        self.assertIn('gone', self.store._pending)
+
+        response = self.client.delete('/api/book/gone/delete/')
+        self.store.flush()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(os.path.exists(os.path.join(self.storage_dir, 'gone')))
+
+    def test_a_write_waiting_for_the_deletion_writes_nothing(self):
+        book = Book.objects.create(slug='late', title='late')
+        save_book(book)
+        flusher = threading.Thread(target=lambda: (self.store.flush('late'), connection.close()))
+        # Delete the way delete_book does, while the write waits for the lock
+        with self.store.lock('late'):
+            flusher.start()
+            while 'late' in self.store._pending:
+                time.sleep(0.01)
+            book.delete()
+        flusher.join(10)
+
+        self.assertFalse(flusher.is_alive())
+        self.assertFalse(os.path.exists(os.path.join(self.storage_dir, 'late')))
+
+
+class OcrModelErrorTests(TestCase):
+    def setUp(self):
+        use_temp_storage(self, METADATA_COALESCE_MS=0)
+        model_registry.reset_ocr_model()
+        self.addCleanup(model_registry.reset_ocr_model)
+        page = np.full((180, 400, 3), 255, dtype=np.uint8)
+        cv2.putText(page, 'xin chao', (20, 60), cv2.FONT_HERSHEY_SIMPLEX, 1.5, (0, 0, 0), 4)
+        _, encoded = cv2.imencode('.png', page)
+        save_page_image(Book.objects.create(slug='ink', title='ink'), '1', encoded.tobytes())
+
+    def test_missing_model_file(self):
+        with override_settings(OCR_BACKEND='keras', OCR_WEIGHTS_PATH=os.path.join(self.storage_dir, 'none.hdf5')):
+            response = self.client.post('/api/book/ink/page/1/ocr/')
+        self.assertEqual(response.status_code, 404)
+        self.assertIn('OCR model not found', response.json()['error'])
+
+    def test_model_that_fails_to_load(self):
+        weights_path = os.path.join(self.storage_dir, 'broken.hdf5')
+        open(weights_path, 'wb').close()
+        with override_settings(OCR_BACKEND='keras', OCR_WEIGHTS_PATH=weights_path), \
+                mock.patch.object(model_registry, 'load_ocr_model', side_effect=OSError('truncated file')):
+            response = self.client.post('/api/book/ink/page/1/ocr/')
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.json()['error'], 'Failed to load OCR model: truncated file')
+
+
+class ModelRegistryTests(SimpleTestCase):
+    def setUp(self):
+        weights = tempfile.NamedTemporaryFile(suffix='.hdf5', delete=False)
+        weights.close()
+        self.weights_path = weights.name
+        self.addCleanup(os.remove, self.weights_path)
+        overrides = override_settings(OCR_WEIGHTS_PATH=self.weights_path, OCR_BACKEND='keras', OCR_HOT_RELOAD=True)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        model_registry.reset_ocr_model()
+        self.addCleanup(model_registry.reset_ocr_model)
+
+    def test_hot_reload_keeps_serving_the_current_model(self):
+        with mock.patch.object(model_registry, 'load_ocr_model', return_value='old'):
+            self.assertEqual(model_registry.get_ocr_model(), 'old')
+
+        loading, release = threading.Event(), threading.Event()
+
+        def slow_load(*args, **kwargs):
+            loading.set()
+            release.wait(10)
+            return 'new'
+
+        os.utime(self.weights_path, (0, os.path.getmtime(self.weights_path) + 10))
+        with mock.patch.object(model_registry, 'load_ocr_model', side_effect=slow_load):
+            reloader = threading.Thread(target=model_registry.get_ocr_model)
+            reloader.start()
+            self.assertTrue(loading.wait(10))
+            # The reload holds the lock; other lookups don't wait for it
+            self.assertEqual(model_registry.get_ocr_model(), 'old')
+            release.set()
+            reloader.join(10)
+        self.assertEqual(model_registry.get_ocr_model(), 'new')
+
+
+def one_hot_outputs(path, classes=3, confidence=0.98):
+    """CRNN-like softmax output following a label path (blank is the last class)"""
+    probs = np.full((1, len(path), classes), (1 - confidence) / (classes - 1), dtype=np.float32)
+    probs[0, np.arange(len(path)), path] = confidence
+    return probs
+
+
+class CTCDecoderTests(SimpleTestCase):
+    def test_repeats_separated_by_blank_are_kept(self):
+        probs = one_hot_outputs([0, 0, 2, 0])  # a, a, blank, a
+        self.assertEqual(greedy_decode(probs, 'ab'), ['aa'])
+        self.assertEqual(beam_search_decode(probs, 'ab', beam_width=5), ['aa'])
+
+    def test_blanks_and_repeats_collapse(self):
+        probs = one_hot_outputs([2, 0, 0, 1, 1, 2])
+        self.assertEqual(greedy_decode(probs, 'ab'), ['ab'])
+        self.assertEqual(beam_search_decode(probs, 'ab', beam_width=5), ['ab'])
+
+    def test_beam_width_is_bounded(self):
+        with override_settings(OCR_MAX_BEAM_WIDTH=50):
+            for beam_width in (0, -1, 51, 1000, '0', 'wide', [5], {}):
+                with self.assertRaises(ValueError):
+                    get_request_decoder({'decoder': 'beam', 'beam_width': beam_width})
+            get_request_decoder({'decoder': 'beam', 'beam_width': 50})
+            get_request_decoder({'decoder': 'beam', 'beam_width': None})
+
+    def test_cached_lines_are_keyed_by_width_mode_and_decoder(self):
+        _, greedy_key = get_request_decoder({'decoder': 'greedy'})
+        _, beam_key = get_request_decoder({'decoder': 'beam', 'beam_width': 5})
+        with override_settings(OCR_VARIABLE_WIDTH=False):
+            fixed = recognition_context(greedy_key)
+        with override_settings(OCR_VARIABLE_WIDTH=True):
+            variable = recognition_context(greedy_key)
+            self.assertNotEqual(recognition_context(beam_key), variable)
+        self.assertNotEqual(fixed, variable)
+
+    def test_malformed_beam_width_is_a_bad_request(self):
+        base_path, session_id, timestamp = new_lines_folder()
+        self.addCleanup(shutil.rmtree, base_path, ignore_errors=True)
+        response = self.client.post('/notebook/extract-text/', json.dumps({
+            'session_id': session_id, 'timestamp': timestamp, 'decoder': 'beam', 'beam_width': [5]}),
+            content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+class SplitPngStreamTests(SimpleTestCase):
+    def test_concatenated_pngs_are_split(self):
+        first, second = blank_page_png(20, 10), blank_page_png(30, 10)
+        self.assertEqual(split_png_stream(first + second), [first, second])
+
+    def test_truncated_or_foreign_data_is_rejected(self):
+        png = blank_page_png(20, 10)
+        with self.assertRaises(ValueError):
+            split_png_stream(png[:-6])
+        with self.assertRaises(ValueError):
+            split_png_stream(png + b'not a png')
+
+
+class SearchFoldingTests(SimpleTestCase):
+    def test_fold_strips_diacritics_and_keeps_length(self):
+        self.assertEqual(fold('Tiếng Việt'), 'tieng viet')
+        self.assertEqual(fold('Đường'), 'duong')
+        self.assertEqual(len(fold('Nghiêng ngả')), len('Nghiêng ngả'))
+
+    def test_snippet_marks_the_original_words(self):
+        self.assertEqual(snippet('Tiếng Việt rất hay', ['viet']), 'Tiếng <mark>Việt</mark> rất hay')
+
+    def test_snippet_escapes_html(self):
+        self.assertIn('&lt;b&gt;', snippet('<b> tiếng việt', ['tieng']))
@@ -1,18 +1,41 @@
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
 from django.urls import path
 from . import views
 
 app_name = 'notebook'
 
-urlpatterns = [
+# Endpoints that run the CRNN / ViT5. With NOTEBOOK_ROLE = 'web' they aren't
+# served, so TensorFlow and torch never load; route these paths to workers
+# started with NOTEBOOK_ROLE = 'ocr' instead.
+ocr_urlpatterns = [
+    path('extract-text/', views.extract_text_from_lines, name='extract_text_from_lines'),
+    path('ocr-lines/', views.ocr_lines, name='ocr_lines'),
+    path('api/ocr/stats/', views.ocr_stats, name='ocr_stats'),
+    path('api/ocr/jobs/<str:job_id>/', views.ocr_job_status, name='ocr_job_status'),
+    path('api/book/<str:book_id>/page/<str:page_id>/ocr/', views.ocr_page, name='ocr_page'),
+]
+
+web_urlpatterns = [
     path('', views.homepage, name='homepage'),
     path('save-lines/', views.save_notebook_lines, name='save_notebook_lines'),
-    path('extract-text/', views.extract_text_from_lines, name='extract_text_from_lines'),
     path('create-book/', views.create_book, name='create-book'),
     path("api/books/", views.list_books, name="list_books"),
+    path("api/search/", views.search_pages, name="search_pages"),
     path('api/book/<str:book_id>/delete/', views.delete_book, name='delete_book'),
     path('api/book/<str:book_id>/', views.load_book_data),
     path('api/book/<str:book_id>/save-page/', views.save_page),
+    path('api/book/<str:book_id>/page/<str:page_id>/strokes/', views.save_page_strokes, name='save_page_strokes'),
     path('notebook-canvas/', views.notebook_canvas, name='notebook_canvas'),
     path("api/book/<str:book_id>/page/<str:page_id>/delete/", views.delete_page, name="delete_page"),
     path("api/book/<str:book_id>/rename/", views.rename_book),
 ]
+
+role = getattr(settings, 'NOTEBOOK_ROLE', 'all')
+if role not in ('all', 'web', 'ocr'):
+    raise ImproperlyConfigured(f"NOTEBOOK_ROLE must be 'all', 'web' or 'ocr', not {role!r}")
+urlpatterns = [path('metrics', views.metrics, name='metrics')]
+if role in ('all', 'ocr'):
+    urlpatterns += ocr_urlpatterns
+if role in ('all', 'web'):
+    urlpatterns += web_urlpatterns
@@ -1,48 +1,214 @@
 import os
-import json
+import uuid
 from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Prefetch
+from django.utils import timezone
 from datetime import datetime
 
-def list_books():
-    base = settings.BOOK_STORAGE_DIR
-    return [name for name in os.listdir(base) if os.path.isdir(os.path.join(base, name))]
+from notebook.instrumentation import timed
+from notebook.metadata_store import MetadataStore, get_metadata_store
+from notebook.models import Book, Page
+from notebook.page_blobs import content_hash, link_blob, remove_unused_blobs, store_blob
+from notebook.search_index import get_search_index
+from notebook.stroke_log import discard_strokes, page_lock
 
-def load_book(book_name):
-    book_path = os.path.join(settings.BOOK_STORAGE_DIR, book_name, 'data.json')
-    if os.path.exists(book_path):
-        with open(book_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return None
+def book_dir(book_id):
+    return os.path.join(settings.BOOK_STORAGE_DIR, book_id)
 
-def save_book(book_name, data):
-    folder = os.path.join(settings.BOOK_STORAGE_DIR, book_name)
-    os.makedirs(folder, exist_ok=True)
-    with open(os.path.join(folder, 'data.json'), 'w', encoding='utf-8') as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+def books_with_pages():
+    """Books with their page ids, in one query each for books and pages"""
+    pages = Prefetch('pages', queryset=Page.objects.only('id', 'book_id', 'page_id', 'position'))
+    return Book.objects.prefetch_related(pages).order_by('created_at', 'id')
+
+def get_book(book_id):
+    return Book.objects.filter(slug=book_id).first()
+
+def get_or_create_book(book_id):
+    """Book of book_id, created if missing
+    A folder with a data.json but no Book (saved before the database held
+    books, or copied in since the import migration ran) is imported first,
+    so its data.json isn't rewritten from an empty Book.
+    """
+    book = get_book(book_id)
+    if book is not None:
+        return book
+    if os.path.isfile(os.path.join(book_dir(book_id), 'data.json')):
+        book, _ = import_book_folder(book_dir(book_id))
+        return book
+    book, _ = Book.objects.get_or_create(slug=book_id, defaults={'title': book_id})
+    return book
+
+def load_book(book_id):
+    book = get_book(book_id)
+    return book.to_dict() if book is not None else None
+
+def save_book(book):
+    """Mirror a book's metadata to book_storage/<id>/data.json
+    The database is the source of truth; the file keeps each book folder self-describing.
+    Writes are atomic and bursts of them are coalesced (see metadata_store).
+    """
+    book_pk = book.pk
+
+    def metadata():
+        # Built when the write happens, so it has every change made meanwhile
+        current = Book.objects.filter(pk=book_pk).first()
+        return current.to_dict() if current is not None else None
+
+    get_metadata_store().schedule(book.slug, metadata)
 
 
 def create_new_book(book_title):
     # Create folder name from title (simple slug)
     folder_name = book_title.strip().lower().replace(' ', '-')
-    book_dir = os.path.join(settings.BOOK_STORAGE_DIR, folder_name)
 
-    if os.path.exists(book_dir):
+    if Book.objects.filter(slug=folder_name).exists() or os.path.exists(book_dir(folder_name)):
         return {'error': 'Book already exists'}, 400
 
-    os.makedirs(book_dir, exist_ok=True)
+    book = Book.objects.create(slug=folder_name, title=book_title)
+    save_book(book)
+
+    return book.to_dict(), 200
+
+
+@timed('page_write')
+def save_page_image(book, page_id, image_content):
+    """Store a page image and record the page (appended after the book's last page if new)
+    Return:
+        (page, changed) where changed is False when the page already had this exact image
+    """
+    image_path = os.path.join(book_dir(book.slug), f"page-{page_id}.png")
+    digest = content_hash(image_content)
+    page = Page.objects.filter(book=book, page_id=page_id).first()
+    if page is not None and page.content_hash == digest and os.path.exists(image_path):
+        return page, False
+
+    store_blob(image_content)
+
+    def next_position():
+        last = book.pages.aggregate(last=Max('position'))['last']
+        return 0 if last is None else last + 1
+
+    with transaction.atomic():
+        # Write before reading: the book's row (SQLite: the database) is locked from here to the
+        # commit, so concurrent saves to the book wait for each other instead of failing
+        book.save(update_fields=['last_modified'])
+        page, _ = Page.objects.get_or_create(book=book, page_id=page_id, defaults={'position': next_position})
+        previous_hash = page.content_hash
+        link_blob(digest, image_path)
+        page.image.name = os.path.relpath(image_path, settings.MEDIA_ROOT)
+        page.content_hash = digest
+        page.save()
+    save_book(book)
+    remove_unused_blobs([previous_hash])
+    return page, True
+
+
+def remove_page(book, page_id):
+    image_path = os.path.join(book_dir(book.slug), f"page-{page_id}.png")
+    # Under the page lock, so a compaction running meanwhile can't save the page again
+    with page_lock(book.slug, page_id):
+        if os.path.exists(image_path):
+            os.remove(image_path)
+        discard_strokes(book.slug, page_id)
+
+        with transaction.atomic():
+            hashes = list(book.pages.filter(page_id=page_id).values_list('content_hash', flat=True))
+            book.pages.filter(page_id=page_id).delete()
+            book.save(update_fields=['last_modified'])
+        save_book(book)
+    remove_unused_blobs(hashes)
+    get_search_index().remove(book.slug, str(page_id))
+
+
+def store_page_text(book_id, page_id, text):
+    """Keep the OCR text of a page and index it for search (no-op for unknown pages)"""
+    updated = Page.objects.filter(book__slug=book_id, page_id=str(page_id)).update(extracted_text=text)
+    if updated:
+        get_search_index().add(book_id, str(page_id), text)
+    return updated
+
+
+def import_book_folder(folder_path):
+    """Create or update the Book and Pages of a book_storage folder from its data.json
+    Return:
+        (book, created)
+    """
+    slug = os.path.basename(os.path.normpath(folder_path))
+    metadata = MetadataStore(os.path.dirname(os.path.normpath(folder_path))).read(slug) or {}
+
+    def parse_date(value):
+        try:
+            return timezone.make_aware(datetime.strptime(value, "%Y-%m-%d"))
+        except (TypeError, ValueError):
+            return timezone.now()
+
+    with transaction.atomic():
+        book, created = Book.objects.get_or_create(slug=slug, defaults={'title': metadata.get('title') or slug})
+        for position, page_id in enumerate(metadata.get('pages', [])):
+            image_path = os.path.join(folder_path, f"page-{page_id}.png")
+            Page.objects.update_or_create(book=book, page_id=str(page_id), defaults={
+                'position': position,
+                'image': os.path.relpath(image_path, settings.MEDIA_ROOT) if os.path.exists(image_path) else '',
+            })
+        # auto_now/auto_now_add fields ignore assigned values, so keep the original dates with update()
+        Book.objects.filter(pk=book.pk).update(title=metadata.get('title') or slug,
+                                               created_at=parse_date(metadata.get('created_at')),
+                                               last_modified=parse_date(metadata.get('last_modified')))
+    return book, created
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+def split_png_stream(data):
+    """Split a body of one or more concatenated PNG files into separate files"""
+    images = []
+    offset = 0
+    while offset < len(data):
+        if data[offset:offset + 8] != PNG_SIGNATURE:
+            raise ValueError(f'Expected a PNG file at byte {offset}')
+        # Walk the chunks (length, type, data, crc) up to IEND
+        position = offset + 8
+        while True:
+            if position + 8 > len(data):
+                raise ValueError('Truncated PNG stream')
+            length = int.from_bytes(data[position:position + 4], 'big')
+            chunk_type = data[position + 4:position + 8]
+            position += 12 + length
+            if position > len(data):
+                raise ValueError('Truncated PNG stream')
+            if chunk_type == b'IEND':
+                break
+        images.append(data[offset:position])
+        offset = position
+    return images
+
+
+def new_lines_folder():
+    """Create a unique notebook_lines folder for one OCR session
+    Return:
+        (base_path, session_id, timestamp)
+    """
+    session_id = str(uuid.uuid4())[:8]
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    base_path = lines_folder_path(session_id, timestamp)
+    os.makedirs(base_path, exist_ok=True)
+    return base_path, session_id, timestamp
+
+
+def lines_folder_path(session_id, timestamp):
+    """notebook_lines folder of an OCR session"""
+    return os.path.join(settings.BASE_DIR, 'notebook_lines', f"notebook_lines_{timestamp}_{session_id}")
 
-    today = datetime.now().strftime("%Y-%m-%d")
 
-    # Final book metadata structure
-    metadata = {
-        "id": folder_name,
-        "title": book_title,
-        "created_at": today,
-        "last_modified": today,
-        "pages": []
-    }
+def list_line_images(base_path):
+    """Paths of line_*.png in base_path, in line order"""
+    return [os.path.join(base_path, filename) for filename in sorted(os.listdir(base_path))
+            if filename.startswith('line_') and filename.endswith('.png')]
 
-    with open(os.path.join(book_dir, "data.json"), "w", encoding="utf-8") as f:
-        json.dump(metadata, f, indent=2, ensure_ascii=False)
 
-    return metadata, 200
\ No newline at end of file
+def save_line_images(base_path, images):
+    """Write PNG bytes as line_001.png, line_002.png, ... in base_path"""
+    for line_number, image_content in enumerate(images, start=1):
+        with open(os.path.join(base_path, f"line_{line_number:03d}.png"), 'wb') as f:
+            f.write(image_content)
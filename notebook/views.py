@@ -11,19 +11,41 @@ from django.views.decorators.http import require_POST
 import json
 import base64
 import os
-from django.http import JsonResponse, HttpResponse, HttpResponseNotFound
+from django.http import JsonResponse, HttpResponse, HttpResponseNotFound, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from django.conf import settings
 from django.shortcuts import render
+from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
+from django.db.models import Count, Max
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+from django.urls import reverse
 from datetime import datetime
-from notebook.RCNNMdoels import *
-from notebook.utils import create_new_book
+import cv2
+from notebook.instrumentation import render_metrics, stage, timing_enabled
+from notebook.metadata_store import get_metadata_store
+from notebook.models import Book
+from notebook.page_blobs import remove_unused_blobs
+from notebook.stroke_log import append_strokes, compact_book, compact_page, discard_strokes, page_lock
+from notebook.search_index import get_search_index
+from notebook.segmentation import segment_page, split_ruled_lines, to_bgr
+from notebook.utils import (book_dir, books_with_pages, create_new_book, get_book, get_or_create_book,
+                            lines_folder_path, list_line_images, new_lines_folder, remove_page, save_book,
+                            save_line_images, save_page_image, split_png_stream, store_page_text)
+from notebook.ocr_jobs import enqueue_job, get_job
+from notebook.ocr_service import (get_model_for_request, get_request_decoder, iter_recognized_lines, read_line_images,
+                                   recognize_arrays, recognize_lines)
+from notebook.result_cache import cache_stats, make_key
+from notebook.inference_queue import get_inference_queue
 from datetime import date 
-from django.utils.timezone import now
 import shutil
+import threading
+import logging
 import uuid
-from notebook.NLPprocess import *
+from notebook.NLPprocess import correct_ocr_lines
+
+logger = logging.getLogger(__name__)
 
 @csrf_exempt
 def homepage(request):
@@ -113,6 +135,42 @@ def save_notebook_lines(request):
             'error': f'Failed to save images: {str(e)}'
         }, status=500)
 
+def ocr_event_stream(line_iter, book_id=None, page_id=None):
+    """Server-Sent Events for a streaming OCR request
+
+    Emits a "line" event per recognized line (1-based "line" number and
+    "text") as each batch finishes, then "original" and "corrected" with the
+    whole text, and finally "done". Failures are reported as an "error" event.
+    With book_id and page_id the corrected text is kept on that Page.
+    """
+    def event(name, payload):
+        return f"event: {name}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+    try:
+        texts = {}
+        for index, text in line_iter:
+            texts[index] = text
+            yield event('line', {'line': index + 1, 'text': text})
+
+        extracted_lines = [texts[index] for index in sorted(texts) if texts[index].strip()]
+        yield event('original', {'text': ' '.join(extracted_lines)})
+        full_text = correct_ocr_lines(extracted_lines)
+        yield event('corrected', {'text': full_text})
+        if book_id and page_id is not None and full_text.strip():
+            store_page_text(book_id, page_id, full_text)
+    except Exception as e:
+        yield event('error', {'error': f'Failed to extract text: {str(e)}'})
+    yield event('done', {})
+
+
+def streaming_ocr_response(line_iter, book_id=None, page_id=None):
+    response = StreamingHttpResponse(ocr_event_stream(line_iter, book_id, page_id),
+                                     content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # don't let a proxy buffer the events
+    return response
+
+
 @csrf_exempt
 @require_http_methods(["POST"])
 def extract_text_from_lines(request):
@@ -126,57 +184,55 @@ def extract_text_from_lines(request):
             return JsonResponse({'error': 'Session ID and timestamp required'}, status=400)
         
         # Construct folder path
-        folder_name = f"notebook_lines_{timestamp}_{session_id}"
-        project_root = settings.BASE_DIR
-        notebook_lines_path = os.path.join(project_root, 'notebook_lines')
-        base_path = os.path.join(notebook_lines_path, folder_name)
+        base_path = lines_folder_path(session_id, timestamp)
         
         if not os.path.exists(base_path):
             return JsonResponse({'error': 'Image folder not found'}, status=404)
-        
-        # Load the OCR model
+
         try:
-            model = Model(inputs, outputs)
-            
-            # Load model weights - Update this path to your model file
-            weights_path = os.path.join(settings.BASE_DIR, 'model_checkpoint_weights.hdf5')
-            if not os.path.exists(weights_path):
-                return JsonResponse({'error': 'OCR model weights not found. Please place model_checkpoint_weights.hdf5 in your project root.'}, status=404)
-            
-            model.load_weights(weights_path)
-        except Exception as e:
-            return JsonResponse({'error': f'Failed to load OCR model: {str(e)}'}, status=500)
+            decoder, decoder_key = get_request_decoder(data)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        if data.get('async'):
+            # Leave OCR to the ocr_worker processes; the client polls the job
+            job_id = enqueue_job(session_id, timestamp, options={
+                'decoder': data.get('decoder'), 'beam_width': data.get('beam_width'),
+                'book_id': data.get('book_id'), 'page_id': data.get('page_id')})
+            return JsonResponse({'job_id': job_id, 'status': 'pending',
+                                 'status_url': reverse('notebook:ocr_job_status', args=[job_id])}, status=202)
         
-        # Get all line images and sort them
-        image_files = []
-        for filename in os.listdir(base_path):
-            if filename.startswith('line_') and filename.endswith('.png'):
-                image_files.append(filename)
+        # Get the shared OCR model (built and loaded once per process)
+        model, error_response = get_model_for_request()
+        if error_response is not None:
+            return error_response
         
-        image_files.sort()  # Sort to ensure correct order
+        # Get all line images in line order
+        image_paths = list_line_images(base_path)
         
-        if not image_files:
+        if not image_paths:
             return JsonResponse({'error': 'No line images found'}, status=404)
         
-        # Extract text from each line
-        extracted_lines = []
-        for filename in image_files:
-            image_path = os.path.join(base_path, filename)
-            line_text = extract_text_from_image(image_path, model, char_list)
-            
-            # Only add non-empty lines
-            if line_text.strip():
-                extracted_lines.append(line_text)
+        # Extract text from all lines in batches
+        line_bytes = read_line_images(image_paths)
+        if data.get('stream'):
+            return streaming_ocr_response(iter_recognized_lines(line_bytes, model, decoder, decoder_key),
+                                          data.get('book_id'), data.get('page_id'))
+        line_texts = recognize_lines(line_bytes, model, decoder, decoder_key)
+
+        # Only keep non-empty lines
+        extracted_lines = [line_text for line_text in line_texts if line_text.strip()]
         
         # Combine all lines into a single text
         full_text = ' '.join(extracted_lines)
-        print("Original Text : ",full_text)
-        print("_______________________________________process ViT correction_______________________________________")
-        full_text = correct_ocr(full_text)
-        print("_______________________________________DONE ViT correction_______________________________________")
-        print("Text after correction : ",full_text)
+        logger.debug("Original text: %s", full_text)
+        full_text = correct_ocr_lines(extracted_lines)
+        logger.debug("Text after correction: %s", full_text)
         if not full_text.strip():
             return JsonResponse({'error': 'No text could be extracted from the images'}, status=404)
+
+        if data.get('book_id') and data.get('page_id') is not None:
+            store_page_text(data['book_id'], data['page_id'], full_text)
         
         # Create response with the text file
         response = HttpResponse(full_text, content_type='text/plain')
@@ -190,6 +246,186 @@ def extract_text_from_lines(request):
         }, status=500)
         
 
+@csrf_exempt
+@require_http_methods(["POST"])
+def ocr_lines(request):
+    """Recognize and correct line images in a single request
+
+    Lines are sent as multipart/form-data files named "lines" (in line order)
+    or as a raw image/png body of one or more concatenated PNGs, and are
+    decoded in memory. Query parameters: decoder, beam_width, persist=1
+    to also save the lines to a notebook_lines folder in the background,
+    book_id and page_id to keep the corrected text on that Page, and
+    stream=1 for Server-Sent Events instead of a text file (see ocr_event_stream).
+    """
+    try:
+        if request.content_type.startswith('multipart/'):
+            line_bytes = [f.read() for f in request.FILES.getlist('lines')]
+        else:
+            try:
+                line_bytes = split_png_stream(request.body)
+            except ValueError as e:
+                return JsonResponse({'error': f'Invalid PNG stream: {str(e)}'}, status=400)
+
+        if not line_bytes:
+            return JsonResponse({'error': 'No images provided'}, status=400)
+
+        try:
+            decoder, decoder_key = get_request_decoder(request.GET)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        model, error_response = get_model_for_request()
+        if error_response is not None:
+            return error_response
+
+        if request.GET.get('persist'):
+            base_path, session_id, timestamp = new_lines_folder()
+            threading.Thread(target=save_line_images, args=(base_path, line_bytes), daemon=True).start()
+        else:
+            session_id = str(uuid.uuid4())[:8]
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+
+        if request.GET.get('stream'):
+            response = streaming_ocr_response(iter_recognized_lines(line_bytes, model, decoder, decoder_key),
+                                              request.GET.get('book_id'), request.GET.get('page_id'))
+            response['X-Session-Id'] = session_id
+            response['X-Timestamp'] = timestamp
+            return response
+
+        line_texts = recognize_lines(line_bytes, model, decoder, decoder_key)
+        extracted_lines = [line_text for line_text in line_texts if line_text.strip()]
+
+        full_text = correct_ocr_lines(extracted_lines)
+        if not full_text.strip():
+            return JsonResponse({'error': 'No text could be extracted from the images'}, status=404)
+
+        if request.GET.get('book_id') and request.GET.get('page_id'):
+            store_page_text(request.GET['book_id'], request.GET['page_id'], full_text)
+
+        response = HttpResponse(full_text, content_type='text/plain')
+        response['Content-Disposition'] = f'attachment; filename="extracted_text_{timestamp}_{session_id}.txt"'
+        response['X-Session-Id'] = session_id
+        response['X-Timestamp'] = timestamp
+        return response
+
+    except Exception as e:
+        return JsonResponse({
+            'error': f'Failed to extract text: {str(e)}'
+        }, status=500)
+
+
+@csrf_exempt
+@require_POST
+def ocr_page(request, book_id, page_id):
+    """Recognize and correct a saved page, segmenting it into lines on the server
+    Query parameters: decoder, beam_width, and segmentation=ruled to split at
+    the canvas' fixed line spacing instead of by the ink's projection profile.
+    The corrected text is kept on the Page.
+    """
+    try:
+        book = get_book(book_id)
+        if book is None:
+            return JsonResponse({'error': 'Book not found'}, status=404)
+        compact_page(book, page_id)
+
+        with stage('read_images'):
+            page_image = cv2.imread(os.path.join(book_dir(book_id), f"page-{page_id}.png"), cv2.IMREAD_UNCHANGED)
+        if page_image is None:
+            return JsonResponse({'error': 'Page not found'}, status=404)
+
+        with stage('segment'):
+            if request.GET.get('segmentation') == 'ruled':
+                lines = split_ruled_lines(to_bgr(page_image))
+            else:
+                lines = segment_page(page_image)
+        if not lines:
+            return JsonResponse({'page': page_id, 'lines': 0, 'original_text': '', 'text': ''})
+
+        try:
+            decoder, decoder_key = get_request_decoder(request.GET)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        model, error_response = get_model_for_request()
+        if error_response is not None:
+            return error_response
+
+        line_texts = recognize_arrays(lines, model, decoder, decoder_key)
+        extracted_lines = [line_text for line_text in line_texts if line_text.strip()]
+        full_text = correct_ocr_lines(extracted_lines)
+        store_page_text(book_id, page_id, full_text)
+
+        return JsonResponse({'page': page_id, 'lines': len(lines),
+                             'original_text': ' '.join(extracted_lines), 'text': full_text})
+
+    except Exception as e:
+        return JsonResponse({
+            'error': f'Failed to extract text: {str(e)}'
+        }, status=500)
+
+
+def search_pages(request):
+    """Pages whose OCR text contains every word of q, diacritics ignored
+    Query parameters: q, book (restrict to one book), page, page_size.
+    Each result has the book id and title, page id, BM25 score and an HTML
+    snippet with the matched words in <mark>.
+    """
+    query = request.GET.get("q", "").strip()
+    if not query:
+        return JsonResponse({"error": "Missing query"}, status=400)
+    try:
+        page_number = max(int(request.GET.get("page", 1)), 1)
+        page_size = min(max(int(request.GET.get("page_size", 20)), 1), 100)
+    except ValueError:
+        return JsonResponse({"error": "Invalid page"}, status=400)
+
+    total, results = get_search_index().search(query, book=request.GET.get("book"),
+                                               offset=(page_number - 1) * page_size, limit=page_size)
+    titles = dict(Book.objects.filter(slug__in={result["book"] for result in results}).values_list("slug", "title"))
+    for result in results:
+        result["book_title"] = titles.get(result["book"], result["book"])
+
+    return JsonResponse({
+        "query": query,
+        "count": total,
+        "page": page_number,
+        "page_size": page_size,
+        "next": page_number + 1 if page_number * page_size < total else None,
+        "results": results,
+    })
+
+
+def ocr_job_status(request, job_id):
+    """Status of a queued OCR job, with its text once done
+    Statuses: pending, running, done (with "text" and "original_text") or failed (with "error").
+    """
+    job = get_job(job_id)
+    if job is None:
+        return JsonResponse({'error': 'Job not found'}, status=404)
+
+    response = {'job_id': job_id, 'status': job['status']}
+    if job['status'] == 'done':
+        response.update(job['result'])
+    elif job['status'] == 'failed':
+        response['error'] = job.get('error')
+    return JsonResponse(response)
+
+
+def metrics(request):
+    """Stage and request duration histograms in Prometheus' text format"""
+    if not timing_enabled():
+        return HttpResponseNotFound('Stage timing is disabled (STAGE_TIMING_ENABLED).')
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def ocr_stats(request):
+    """Dynamic batching queue statistics and result cache hit/miss counters"""
+    stats = get_inference_queue().stats()
+    stats['caches'] = cache_stats()
+    return JsonResponse(stats)
+
+
 @csrf_exempt
 def create_book(request):
     if request.method == "POST":
@@ -202,136 +438,163 @@ def create_book(request):
         return JsonResponse(result, status=status)
 
 
+BOOK_SORT_FIELDS = {
+    "last_modified": ("last_modified", "id"),
+    "-last_modified": ("-last_modified", "-id"),
+    "created_at": ("created_at", "id"),
+    "-created_at": ("-created_at", "-id"),
+    "title": ("title", "id"),
+}
+
+
+def book_list_etag(request):
+    """Changes whenever a book is created, renamed, deleted or has a page saved/deleted"""
+    catalog = Book.objects.aggregate(count=Count("id"), last_modified=Max("last_modified"))
+    return make_key(catalog["count"], catalog["last_modified"], request.GET.urlencode())
+
+
+@condition(etag_func=book_list_etag)
 def list_books(request):
-    books = []
-    base_path = settings.BOOK_STORAGE_DIR
-    for folder_name in os.listdir(base_path):
-        folder_path = os.path.join(base_path, folder_name)
-        json_path = os.path.join(folder_path, "data.json")
-        if os.path.isfile(json_path):
-            with open(json_path, "r", encoding="utf-8") as f:
-                try:
-                    book_data = json.load(f)
-                    books.append(book_data)
-                except Exception as e:
-                    continue  # skip corrupted file
-    return JsonResponse({"books": books})
+    """Books as in data.json, newest change first by default
+    Query parameters: sort (see BOOK_SORT_FIELDS), page, page_size.
+    Responses carry an ETag so clients revalidate with If-None-Match (304 when unchanged).
+    """
+    sort = request.GET.get("sort", "-last_modified")
+    if sort not in BOOK_SORT_FIELDS:
+        return JsonResponse({"error": f"Unknown sort: {sort}"}, status=400)
+    try:
+        page_number = int(request.GET.get("page", 1))
+        page_size = min(int(request.GET.get("page_size", getattr(settings, "BOOK_LIST_PAGE_SIZE", 50))),
+                        getattr(settings, "BOOK_LIST_MAX_PAGE_SIZE", 500))
+        page = Paginator(books_with_pages().order_by(*BOOK_SORT_FIELDS[sort]), max(page_size, 1)).page(page_number)
+    except (ValueError, EmptyPage, PageNotAnInteger) as e:
+        return JsonResponse({"error": f"Invalid page: {e}"}, status=400)
+
+    response = JsonResponse({
+        "books": [book.to_dict() for book in page.object_list],
+        "count": page.paginator.count,
+        "page": page.number,
+        "page_size": page.paginator.per_page,
+        "next": page.next_page_number() if page.has_next() else None,
+    })
+    patch_cache_control(response, no_cache=True)
+    return response
 
 @csrf_exempt
 @require_http_methods(["DELETE"])
 def delete_book(request, book_id):
     """
-    Deletes an entire book folder and its contents.
+    Deletes a book, its pages and its folder.
     URL: DELETE /api/book/<book_id>/delete/
     """
-    # Path to the book folder
-    book_dir = os.path.join(settings.BOOK_STORAGE_DIR, book_id)
-
-    if not os.path.isdir(book_dir):
+    book = get_book(book_id)
+    if book is None:
         return JsonResponse({"error": "Book not found"}, status=404)
 
-    # Remove the entire directory
+    # Remove the entire directory, then the rows
+    book_path = book_dir(book_id)
+    metadata_store = get_metadata_store()
+    metadata_store.discard(book_id)
+    hashes = list(book.pages.values_list("content_hash", flat=True))
     try:
-        shutil.rmtree(book_dir)
+        with metadata_store.lock(book_id):
+            if os.path.isdir(book_path):
+                shutil.rmtree(book_path)
+            book.delete()
     except Exception as e:
         return JsonResponse({"error": f"Could not delete book: {e}"}, status=500)
+    remove_unused_blobs(hashes)
+    get_search_index().remove(book_id)
 
     return JsonResponse({"status": "deleted", "book_id": book_id})
 
 
 def load_book_data(request, book_id):
-    book_dir = os.path.join(settings.BOOK_STORAGE_DIR, book_id)
-    data_file = os.path.join(book_dir, 'data.json')
+    book = get_book(book_id)
 
-    if not os.path.exists(data_file):
+    if book is None:
         return HttpResponseNotFound('Book not found.')
 
-    with open(data_file, 'r', encoding='utf-8') as f:
-        book_data = json.load(f)
-    
-    return JsonResponse(book_data)
+    # Bring page images up to date before the canvas loads them
+    compact_book(book)
+
+    return JsonResponse(book.to_dict())
 
 @csrf_exempt
 @require_POST
 def save_page(request, book_id):
+    """Save a page image
+    The image is either the raw request body (Content-Type image/png, page id
+    in the page_id query parameter) or a base64 data URL in JSON
+    {"page_id", "image_data"}. Saving an unchanged image is a no-op.
+    """
     try:
-        data = json.loads(request.body.decode("utf-8"))
-        page_id = str(data.get("page_id"))
-        image_data = data.get("image_data")
+        if request.content_type.startswith("image/") or request.content_type == "application/octet-stream":
+            page_id = request.GET.get("page_id")
+            image_content = request.body
+        else:
+            data = json.loads(request.body.decode("utf-8"))
+            page_id = str(data.get("page_id"))
+            image_data = data.get("image_data")
+            image_content = base64.b64decode(image_data.split(",")[1]) if image_data else None
 
-        if not page_id or not image_data:
+        if not page_id or not image_content:
             return JsonResponse({"error": "Missing page_id or image_data"}, status=400)
 
-        # Path to book folder
-        book_dir = os.path.join(settings.BOOK_STORAGE_DIR, book_id)
-        os.makedirs(book_dir, exist_ok=True)
+        book = get_or_create_book(book_id)
 
-        # Save page image
-        image_path = os.path.join(book_dir, f"page-{page_id}.png")
-        with open(image_path, "wb") as f:
-            f.write(base64.b64decode(image_data.split(",")[1]))
+        # Save page image and record the page; it supersedes any logged strokes.
+        # Under the page lock, so a compaction can't rewrite the old image and its strokes over it
+        with page_lock(book_id, page_id):
+            _, changed = save_page_image(book, page_id, image_content)
+            discard_strokes(book_id, page_id)
 
-        # Update data.json
-        data_json_path = os.path.join(book_dir, "data.json")
-
-        if os.path.exists(data_json_path):
-            with open(data_json_path, "r", encoding="utf-8") as f:
-                metadata = json.load(f)
-        else:
-            metadata = {
-                "id": book_id,
-                "title": book_id,
-                "created_at": now().date().isoformat(),
-                "last_modified": now().date().isoformat(),
-                "pages": []
-            }
+        return JsonResponse({"status": "saved" if changed else "unchanged", "page": page_id})
 
-        if "pages" not in metadata:
-            metadata["pages"] = []
-
-        # Avoid duplicates
-        if page_id not in metadata["pages"]:
-            metadata["pages"].append(page_id)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
+    
+    
+@csrf_exempt
+@require_POST
+def save_page_strokes(request, book_id, page_id):
+    """Save pen strokes drawn on an already saved page
+    Body: {"strokes": [{"tool": "pen", "color": "#rrggbb", "size": px, "points": [[x, y], ...]}]}
+    Strokes are logged and later compacted into the page image (see stroke_log).
+    Returns 409 when the page has no saved image to draw on; the canvas then saves the full page.
+    """
+    try:
+        data = json.loads(request.body.decode("utf-8"))
+        strokes = data.get("strokes")
+        if not strokes:
+            return JsonResponse({"error": "Missing strokes"}, status=400)
 
-        metadata["last_modified"] = now().date().isoformat()
+        book = get_book(book_id)
+        if book is None or not os.path.exists(os.path.join(book_dir(book_id), f"page-{page_id}.png")):
+            return JsonResponse({"error": "Page has no saved image; save the full page"}, status=409)
 
-        with open(data_json_path, "w", encoding="utf-8") as f:
-            json.dump(metadata, f, indent=2, ensure_ascii=False)
+        try:
+            pending, compacted = append_strokes(book, page_id, strokes)
+        except (ValueError, TypeError) as e:
+            return JsonResponse({"error": str(e)}, status=400)
 
-        return JsonResponse({"status": "saved", "page": page_id})
+        return JsonResponse({"status": "saved", "page": page_id, "pending_strokes": pending, "compacted": compacted})
 
     except Exception as e:
         return JsonResponse({"error": str(e)}, status=500)
-    
-    
+
+
 @csrf_exempt
 @require_http_methods(["DELETE"])
 def delete_page(request, book_id, page_id):
-    book_dir = os.path.join(settings.BOOK_STORAGE_DIR, book_id)
-    image_path = os.path.join(book_dir, f"page-{page_id}.png")
-    data_path = os.path.join(book_dir, "data.json")
-
-    if not os.path.exists(data_path):
+    book = get_book(book_id)
+    if book is None:
         return JsonResponse({"error": "Book not found"}, status=404)
 
-    # Delete image
-    if os.path.exists(image_path):
-        os.remove(image_path)
-
-    # Update data.json
-    with open(data_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
-
-    if "pages" in data:
-        data["pages"] = [pid for pid in data["pages"] if str(pid) != str(page_id)]
-
-    with open(data_path, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+    remove_page(book, page_id)
 
     return JsonResponse({"status": "deleted", "page_id": page_id})
 
-@csrf_exempt
-@require_http_methods(["POST"])
 @csrf_exempt
 @require_http_methods(["POST"])
 def rename_book(request, book_id):
@@ -341,22 +604,13 @@ def rename_book(request, book_id):
         if not new_title:
             return JsonResponse({"error": "New title is required"}, status=400)
 
-        book_dir = os.path.join(settings.BOOK_STORAGE_DIR, book_id)
-        if not os.path.exists(book_dir):
+        book = get_book(book_id)
+        if book is None:
             return JsonResponse({"error": "Book not found"}, status=404)
 
-        data_json = os.path.join(book_dir, "data.json")
-        if os.path.exists(data_json):
-            with open(data_json, "r", encoding="utf-8") as f:
-                metadata = json.load(f)
-        else:
-            metadata = {}
-
-        metadata["title"] = new_title
-        metadata["last_modified"] = datetime.now().date().isoformat()
-
-        with open(data_json, "w", encoding="utf-8") as f:
-            json.dump(metadata, f, indent=2, ensure_ascii=False)
+        book.title = new_title
+        book.save(update_fields=["title", "last_modified"])
+        save_book(book)
 
         return JsonResponse({
             "success": True,